@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, func, insert, select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .config import settings
+from .database import SessionLocal
+from .models import ListeningDailyBook, ListeningDailyUser, ListeningEvent, RollupState
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_NAME = "listening_daily"
+
+def _rebuild_day(db: Session, day: date):
+    """Пересчет сверток за день по событиям журнала.
+
+    Число уникальных слушателей нельзя досуммировать, поэтому затронутый
+    новыми событиями день пересчитывается целиком (это события одного дня)."""
+    start = datetime.combine(day, datetime.min.time())
+    in_day = and_(ListeningEvent.occurred_at >= start, ListeningEvent.occurred_at < start + timedelta(days=1))
+    event_day = func.date(ListeningEvent.occurred_at)
+
+    db.query(ListeningDailyBook).filter(ListeningDailyBook.day == day).delete(synchronize_session=False)
+    db.execute(insert(ListeningDailyBook).from_select(
+        ["day", "book_id", "listened_seconds", "listeners", "events"],
+        select(
+            event_day,
+            ListeningEvent.book_id,
+            func.sum(ListeningEvent.listened_seconds),
+            func.count(ListeningEvent.user_id.distinct()),
+            func.count(ListeningEvent.id)
+        ).where(in_day).group_by(event_day, ListeningEvent.book_id)
+    ))
+
+    db.query(ListeningDailyUser).filter(ListeningDailyUser.day == day).delete(synchronize_session=False)
+    db.execute(insert(ListeningDailyUser).from_select(
+        ["day", "user_id", "listened_seconds", "books", "events"],
+        select(
+            event_day,
+            ListeningEvent.user_id,
+            func.sum(ListeningEvent.listened_seconds),
+            func.count(ListeningEvent.book_id.distinct()),
+            func.count(ListeningEvent.id)
+        ).where(in_day).group_by(event_day, ListeningEvent.user_id)
+    ))
+
+def run_rollup(db: Session) -> int:
+    """Свертка событий после водяного знака; возвращает количество пересчитанных дней"""
+    state = db.get(RollupState, ROLLUP_NAME)
+    if state is None:
+        state = RollupState(name=ROLLUP_NAME, last_event_id=0)
+        db.add(state)
+
+    last_event_id = db.query(func.max(ListeningEvent.id)).scalar() or 0
+    if last_event_id <= state.last_event_id:
+        return 0
+
+    # Дни старше срока хранения не пересчитываются: их события уже удалены
+    cutoff = datetime.utcnow().date() - timedelta(days=settings.listening_events_retention_days)
+    days = {
+        date.fromisoformat(day)
+        for (day,) in db.query(func.date(ListeningEvent.occurred_at)).filter(
+            ListeningEvent.id > state.last_event_id,
+            ListeningEvent.id <= last_event_id
+        ).distinct()
+    }
+    days = sorted(day for day in days if day >= cutoff)
+
+    try:
+        for day in days:
+            _rebuild_day(db, day)
+        state.last_event_id = last_event_id
+        db.query(ListeningEvent).filter(
+            ListeningEvent.id <= last_event_id,
+            ListeningEvent.occurred_at < datetime.combine(cutoff, datetime.min.time())
+        ).delete(synchronize_session=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(days)
+
+def rollup_listening_events():
+    """Свертка в отдельной сессии (для фоновой задачи)"""
+    db = SessionLocal()
+    try:
+        return run_rollup(db)
+    finally:
+        db.close()
+
+async def run_rollup_job():
+    """Фоновая задача: периодическая свертка журнала прослушиваний"""
+    while True:
+        await asyncio.sleep(settings.analytics_rollup_interval)
+        try:
+            await run_in_threadpool(rollup_listening_events)
+        except Exception:
+            logger.exception("Failed to roll up listening events")
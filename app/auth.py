@@ -2,6 +2,8 @@ import hashlib
 import hmac
 import json
 import time
+import uuid
+from functools import lru_cache
 from urllib.parse import parse_qs
 from datetime import datetime, timedelta
 from typing import Optional, Dict
@@ -9,13 +11,67 @@ from typing import Optional, Dict
 from jose import JWTError, jwt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, make_transient_to_detached
 
+from .cache import LRUCache
 from .config import settings
 from .database import get_db
 from .models import User, Admin
+from .revocation import revocation_list
 
 security = HTTPBearer()
+# Для необязательной авторизации: без заголовка зависимость возвращает None, а не 403
+optional_security = HTTPBearer(auto_error=False)
+
+# Снимки пользователей по id: зависимости авторизации не обращаются к БД при попадании.
+# Живут ограниченно, так как изменения в другом воркере сюда не доходят
+user_cache = LRUCache(maxsize=settings.user_cache_size, ttl=settings.user_cache_ttl)
+
+def load_user(db: Session, user_id: int) -> Optional[User]:
+    """Пользователь из кэша снимков (присоединяется к сессии без SELECT) или из БД"""
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return db.merge(cached, load=False)
+    
+    user = db.query(User).filter(User.id == user_id).first()
+    if user is not None:
+        # Отсоединенная копия колонок: кэш не держит объект чужой сессии
+        snapshot = User(**{column.key: getattr(user, column.key) for column in User.__table__.columns})
+        make_transient_to_detached(snapshot)
+        user_cache.set(user_id, snapshot)
+    return user
+
+# Проверенные claims по SHA-256 токена; запись живет до exp токена
+token_cache = LRUCache(maxsize=settings.token_cache_size)
+
+def decode_token(token: str) -> Dict:
+    """Проверка подписи и разбор JWT с запоминанием результата до истечения токена"""
+    digest = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(digest)
+    if payload is not None:
+        return payload
+    
+    payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+    expires_in = payload.get("exp", 0) - time.time()
+    if expires_in > 0:
+        token_cache.set(digest, payload, ttl=expires_in)
+    return payload
+
+def revoke_token(db: Session, token: str):
+    """Отзыв токена до его истечения (выход из аккаунта)"""
+    payload = decode_token(token)
+    if not payload.get("jti"):
+        raise HTTPException(status_code=400, detail="Token cannot be revoked")
+    revocation_list.revoke(db, payload["jti"], datetime.utcfromtimestamp(payload["exp"]))
+
+def invalidate_user(user_id: int):
+    """Сброс снимка после изменения пользователя"""
+    user_cache.pop(user_id)
+
+@lru_cache(maxsize=4)
+def webapp_secret(bot_token: str) -> bytes:
+    """Секретный ключ проверки initData (HMAC токена бота), вычисляется один раз"""
+    return hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
 
 def validate_telegram_data(init_data: str, bot_token: str) -> Optional[Dict]:
     """Валидация данных от Telegram Web App"""
@@ -36,19 +92,13 @@ def validate_telegram_data(init_data: str, bot_token: str) -> Optional[Dict]:
         data_check_string = '\n'.join(sorted(data_pairs))
         
         # Проверяем подпись
-        secret_key = hmac.new(
-            b"WebAppData", 
-            bot_token.encode(), 
-            hashlib.sha256
-        ).digest()
-        
         calculated_hash = hmac.new(
-            secret_key,
+            webapp_secret(bot_token),
             data_check_string.encode(),
             hashlib.sha256
         ).hexdigest()
         
-        if calculated_hash != hash_value:
+        if not hmac.compare_digest(calculated_hash, hash_value):
             return None
             
         # Проверяем время
@@ -73,7 +123,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.access_token_expire_minutes)
     
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
     return encoded_jwt
 
@@ -83,7 +133,8 @@ def create_admin_token(admin_id: int) -> str:
     to_encode = {
         "sub": str(admin_id),
         "type": "admin",
-        "exp": expire
+        "exp": expire,
+        "jti": uuid.uuid4().hex
     }
     return jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
 
@@ -99,14 +150,18 @@ async def get_current_user(
     )
     
     try:
-        payload = jwt.decode(credentials.credentials, settings.secret_key, algorithms=[settings.algorithm])
+        payload = decode_token(credentials.credentials)
         user_id: int = int(payload.get("sub"))
         if user_id is None:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.id == user_id).first()
+    # Разобранные claims кэшируются, поэтому отзыв проверяется на каждом запросе
+    if revocation_list.is_revoked(db, payload.get("jti")):
+        raise credentials_exception
+    
+    user = load_user(db, user_id)
     if user is None:
         raise credentials_exception
     
@@ -124,9 +179,11 @@ async def get_current_admin(
     )
     
     try:
-        payload = jwt.decode(credentials.credentials, settings.secret_key, algorithms=[settings.algorithm])
+        payload = decode_token(credentials.credentials)
         if payload.get("type") != "admin":
             raise HTTPException(status_code=401, detail="Invalid token type")
+        if revocation_list.is_revoked(db, payload.get("jti")):
+            raise credentials_exception
         
         admin_id = int(payload.get("sub"))
         admin = db.query(Admin).filter(Admin.id == admin_id, Admin.is_active == True).first()
@@ -139,7 +196,7 @@ async def get_current_admin(
         raise credentials_exception
 
 async def get_optional_user(
-    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
     db: Session = Depends(get_db)
 ) -> Optional[User]:
     """Получение пользователя из токена (опционально)"""
@@ -147,12 +204,13 @@ async def get_optional_user(
         return None
     
     try:
-        payload = jwt.decode(credentials.credentials, settings.secret_key, algorithms=[settings.algorithm])
+        payload = decode_token(credentials.credentials)
         user_id: int = int(payload.get("sub"))
         if user_id is None:
             return None
+        if revocation_list.is_revoked(db, payload.get("jti")):
+            return None
         
-        user = db.query(User).filter(User.id == user_id).first()
-        return user
+        return load_user(db, user_id)
     except JWTError:
         return None 
\ No newline at end of file
@@ -0,0 +1,139 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, NamedTuple, Optional
+from urllib.parse import urlencode
+
+from fastapi import Request, Response
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import Book, CatalogState
+
+_MISSING = object()
+
+class LRUCache:
+    """Ограниченный по размеру кэш с вытеснением LRU и временем жизни записей"""
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+            return default if item is _MISSING else item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+class CatalogVersion:
+    """Поколение каталога: счетчик в БД, увеличиваемый при изменениях книг и категорий.
+
+    Кэши каталога включают поколение в ключ, поэтому запись админа делает их
+    неактуальными во всех воркерах. Каждый воркер перечитывает счетчик не чаще
+    раза в settings.catalog_version_check_interval секунд."""
+
+    def __init__(self):
+        self._value: Optional[int] = None
+        self._checked_at = 0.0
+
+    def get(self, db: Session) -> int:
+        now = time.monotonic()
+        if self._value is None or now - self._checked_at > settings.catalog_version_check_interval:
+            generation = db.query(CatalogState.generation).filter(CatalogState.id == 1).scalar()
+            self._value = generation or 0
+            self._checked_at = now
+        return self._value
+
+    def bump(self, db: Session):
+        """Увеличение поколения в транзакции вызывающего кода (коммит - на нем)"""
+        db.execute(
+            update(CatalogState)
+            .where(CatalogState.id == 1)
+            .values(generation=CatalogState.generation + 1)
+        )
+        # Перечитать значение из БД при следующем обращении
+        self._value = None
+
+catalog_version = CatalogVersion()
+
+# Существование активной книги по (поколение каталога, id): частые обновления
+# прогресса не обращаются к таблице книг
+active_book_cache = LRUCache(maxsize=settings.book_json_cache_size)
+
+def is_active_book(db: Session, book_id: int) -> bool:
+    key = (catalog_version.get(db), book_id)
+    exists = active_book_cache.get(key)
+    if exists is None:
+        exists = db.query(Book.id).filter(Book.id == book_id, Book.is_active == True).first() is not None
+        active_book_cache.set(key, exists)
+    return exists
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+
+# Готовые JSON-ответы каталога для запросов без токена
+response_cache = LRUCache(maxsize=settings.response_cache_size, ttl=settings.response_cache_ttl)
+
+def anonymous_cache_key(request: Request, db: Session) -> tuple:
+    """Ключ кэша: поколение каталога, путь и отсортированная строка запроса"""
+    query = urlencode(sorted(request.query_params.multi_items()))
+    return (catalog_version.get(db), request.url.path, query)
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+def _json_response(request: Request, cached: CachedResponse) -> Response:
+    headers = {"ETag": cached.etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request, cached.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cached.body, media_type="application/json", headers=headers)
+
+def get_cached_response(request: Request, key: tuple) -> Optional[Response]:
+    """Ответ из кэша (или 304 при совпадении If-None-Match), None при промахе"""
+    cached = response_cache.get(key)
+    if cached is None:
+        return None
+    return _json_response(request, cached)
+
+def cache_response(request: Request, key: tuple, body: bytes) -> Response:
+    """Сохранение сериализованного ответа в кэш и выдача с ETag"""
+    cached = CachedResponse(body=body, etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+    response_cache.set(key, cached)
+    return _json_response(request, cached)
+
@@ -14,6 +14,17 @@ class Settings(BaseSettings):
     secret_key: str = "audioflow-secret-key-2024-very-secure-min-32-chars"
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 10080  # 7 days
+    user_cache_size: int = 10000  # Снимки пользователей для зависимостей авторизации
+    user_cache_ttl: int = 60
+    token_cache_size: int = 10000  # Проверенные JWT (хранятся до exp токена)
+    password_hash_workers: int = 2  # Потоки для bcrypt при входе администратора
+    admin_login_window: int = 300  # Окно ограничения попыток входа, секунды
+    admin_login_attempts_per_username: int = 5
+    admin_login_attempts_per_ip: int = 20
+    admin_login_throttle_size: int = 10000  # Число отслеживаемых логинов и IP
+    revocation_sync_interval: float = 5.0  # Как часто воркер подгружает новые отозванные токены, сек
+    revocation_bloom_capacity: int = 100000  # Отозванных токенов до перестроения фильтра Блума
+    revocation_bloom_error_rate: float = 0.001  # Доля ложных срабатываний (проверяются по БД)
     
     # Database
     database_url: str = "sqlite:///./data/audioflow.db"
@@ -32,6 +43,31 @@ class Settings(BaseSettings):
     upload_dir: str = "./app/static/uploads"
     max_file_size: int = 104857600  # 100MB
     
+    # Search
+    suggest_index_ttl: int = 300  # Полная перезагрузка индекса подсказок, сек
+    suggest_min_similarity: float = 0.4  # Доля общих триграмм с запросом
+    facet_duration_buckets: str = "3600,10800,36000"  # Границы интервалов длительности, сек
+    facet_rating_buckets: str = "3,4,4.5"  # Границы интервалов рейтинга
+    
+    # Cache
+    catalog_version_check_interval: float = 1.0  # Как часто воркер перечитывает поколение каталога, сек
+    count_cache_size: int = 1024
+    count_cache_ttl: int = 300  # Рейтинг меняется без участия админа, поэтому счетчики живут ограниченно
+    response_cache_size: int = 2048
+    response_cache_ttl: int = 30  # Ограничивает устаревание plays_count и rating в анонимных ответах
+    book_json_cache_size: int = 10000  # Сериализованные BookResponse
+    idempotency_cache_size: int = 10000  # Ответы для повторов с Idempotency-Key
+    idempotency_ttl: int = 86400
+    
+    # Listening progress
+    progress_flush_interval: float = 5.0  # Период записи буфера прогресса, сек
+    progress_buffer_max_pending: int = 5000  # При переполнении буфер записывается сразу
+    play_session_gap: int = 1800  # Пауза, после которой прослушивание - новый сеанс, сек
+    
+    # Analytics
+    analytics_rollup_interval: int = 300  # Период свертки журнала прослушиваний, сек
+    listening_events_retention_days: int = 90  # Срок хранения сырых событий журнала
+    
     # Server
     host: str = "0.0.0.0"
     port: int = 8000
@@ -0,0 +1,146 @@
+import hashlib
+from typing import List, NamedTuple, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .cache import LRUCache
+from .config import settings
+
+IDEMPOTENT_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+IDEMPOTENT_PATH_PREFIX = "/api/user/"
+MAX_KEY_LENGTH = 255
+
+class StoredResponse(NamedTuple):
+    fingerprint: str  # Хэш строки запроса и тела: ключ нельзя переиспользовать для другого запроса
+    status_code: int
+    headers: List[Tuple[bytes, bytes]]  # Как в http.response.start, включая повторяющиеся
+    body: bytes
+
+class InProgress(NamedTuple):
+    fingerprint: str
+
+# Ответы по (хэш токена, метод, путь, Idempotency-Key). Хранилище в памяти
+# воркера: повтор, попавший в другой воркер, выполнится заново
+idempotency_store = LRUCache(maxsize=settings.idempotency_cache_size, ttl=settings.idempotency_ttl)
+
+class IdempotencyMiddleware:
+    """Повтор мутирующего запроса к /api/user с тем же заголовком Idempotency-Key
+    получает сохраненный ответ без выполнения эндпоинта и обращений к БД.
+
+    ASGI-middleware без BaseHTTPMiddleware: остальные запросы проходят к приложению
+    напрямую, а ответ эндпоинта отдается клиенту по мере отправки"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in IDEMPOTENT_METHODS
+            or not scope["path"].startswith(IDEMPOTENT_PATH_PREFIX)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        key = headers.get("idempotency-key")
+        if not key:
+            await self.app(scope, receive, send)
+            return
+
+        if len(key) > MAX_KEY_LENGTH:
+            response = JSONResponse(status_code=400, content={"detail": "Idempotency-Key is too long"})
+            await response(scope, receive, send)
+            return
+
+        store_key = (
+            hashlib.sha256(headers.get("authorization", "").encode()).hexdigest(),
+            scope["method"],
+            scope["path"],
+            key
+        )
+        body = await _read_body(receive)
+        if body is None:
+            return
+        fingerprint = hashlib.sha256(scope["query_string"] + b"\0" + body).hexdigest()
+
+        # Между get и set нет await, поэтому проверка атомарна в рамках воркера
+        stored = idempotency_store.get(store_key)
+        if stored is None:
+            idempotency_store.set(store_key, InProgress(fingerprint))
+        elif stored.fingerprint != fingerprint:
+            response = JSONResponse(
+                status_code=422,
+                content={"detail": "Idempotency-Key was used with a different request"}
+            )
+            await response(scope, receive, send)
+            return
+        elif isinstance(stored, InProgress):
+            response = JSONResponse(
+                status_code=409,
+                content={"detail": "Request with this Idempotency-Key is in progress"}
+            )
+            await response(scope, receive, send)
+            return
+        else:
+            await send({
+                "type": "http.response.start",
+                "status": stored.status_code,
+                "headers": stored.headers + [(b"idempotent-replayed", b"true")]
+            })
+            await send({"type": "http.response.body", "body": stored.body})
+            return
+
+        body_consumed = False
+
+        async def replay_body() -> Message:
+            # Эндпоинт получает уже прочитанное тело, дальше - сообщения клиента (disconnect)
+            nonlocal body_consumed
+            if body_consumed:
+                return await receive()
+            body_consumed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        start: Message = {}
+        chunks: List[bytes] = []
+        complete = False
+
+        async def capture(message: Message):
+            nonlocal start, complete
+            if message["type"] == "http.response.start":
+                start = message
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                complete = not message.get("more_body", False)
+            await send(message)
+
+        # Отметка "в работе" снимается при любом выходе, включая отмену задачи
+        # (CancelledError не наследуется от Exception), иначе повтор получал бы 409 до истечения TTL
+        saved = False
+        try:
+            await self.app(scope, replay_body, capture)
+            # Ошибки сервера не сохраняются, чтобы повтор мог выполниться успешно
+            if complete and start["status"] < 500:
+                idempotency_store.set(store_key, StoredResponse(
+                    fingerprint=fingerprint,
+                    status_code=start["status"],
+                    headers=list(start.get("headers", [])),
+                    body=b"".join(chunks)
+                ))
+                saved = True
+        finally:
+            if not saved:
+                idempotency_store.pop(store_key)
+
+async def _read_body(receive: Receive) -> Optional[bytes]:
+    """Тело запроса целиком из сообщений http.request; None - клиент отключился"""
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
@@ -1,18 +1,24 @@
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.templating import Jinja2Templates
+import asyncio
 import os
 
 from .config import settings
 from .database import engine
 from .models import Base
+from .migrations import run_migrations
+from .progress_buffer import flush_progress_buffer, run_progress_flusher
+from .analytics import run_rollup_job
+from .idempotency import IdempotencyMiddleware
 from .routers import auth, books, categories, users, admin, upload
 from .utils import ensure_directory_exists
 
-# Создание таблиц БД
+# Создание таблиц БД и применение миграций
 Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 
 # Создание необходимых директорий
 ensure_directory_exists(settings.upload_dir)
@@ -24,9 +30,13 @@ app = FastAPI(
     title="AudioFlow API",
     description="Telegram Mini App для прослушивания аудиокниг",
     version="1.0.0",
-    debug=settings.debug
+    debug=settings.debug,
+    default_response_class=ORJSONResponse
 )
 
+# Повторы мутирующих запросов пользователя по Idempotency-Key
+app.add_middleware(IdempotencyMiddleware)
+
 # Настройка CORS
 app.add_middleware(
     CORSMiddleware,
@@ -48,6 +58,21 @@ app.include_router(users.router)
 app.include_router(admin.router)
 app.include_router(upload.router)
 
+@app.on_event("startup")
+async def start_background_jobs():
+    """Запуск записи буфера прогресса и свертки журнала прослушиваний"""
+    app.state.background_jobs = [
+        asyncio.create_task(run_progress_flusher()),
+        asyncio.create_task(run_rollup_job()),
+    ]
+
+@app.on_event("shutdown")
+async def stop_background_jobs():
+    """Остановка фоновых задач и запись оставшегося прогресса"""
+    for job in app.state.background_jobs:
+        job.cancel()
+    flush_progress_buffer()
+
 # Jinja2 шаблоны для админ панели
 templates = Jinja2Templates(directory="app/admin/templates")
 
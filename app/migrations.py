@@ -0,0 +1,355 @@
+"""
+Идемпотентные шаги обновления схемы БД.
+
+Base.metadata.create_all создает только отсутствующие таблицы, поэтому все,
+что нужно досоздать в уже существующей базе (FTS-индексы, триггеры и т.п.),
+выполняется здесь. Каждый шаг можно безопасно запускать при каждом старте.
+"""
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from .models import Base
+
+def _table_exists(conn: Connection, name: str) -> bool:
+    """Проверка существования таблицы в SQLite"""
+    return conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = :name"),
+        {"name": name}
+    ).first() is not None
+
+def add_missing_columns(conn: Connection):
+    """Колонки из моделей, добавленные после создания таблиц (ALTER TABLE ADD COLUMN)"""
+    for table in Base.metadata.sorted_tables:
+        existing = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table.name})"))}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+            # SQLite разрешает NOT NULL в добавляемой колонке только со значением по умолчанию
+            default = getattr(column.server_default, "arg", None)
+            if isinstance(default, str):
+                ddl += f" DEFAULT {default}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+            conn.execute(text(ddl))
+
+def create_missing_indexes(conn: Connection):
+    """Индексы из моделей, добавленные после создания таблиц"""
+    created = False
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name"),
+                {"name": index.name}
+            ).first() is None:
+                index.create(bind=conn)
+                created = True
+
+    # Свежая статистика, чтобы планировщик выбирал новые индексы
+    if created:
+        conn.execute(text("ANALYZE"))
+
+def create_books_fts(conn: Connection):
+    """Полнотекстовый индекс FTS5 по книгам, синхронизируемый триггерами"""
+    fts_existed = _table_exists(conn, "books_fts")
+
+    # unicode61 приводит к нижнему регистру любые буквы Unicode, включая кириллицу;
+    # префиксные индексы ускоряют поиск по первым буквам при наборе
+    conn.execute(text("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            title, author, description,
+            content='books', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    """))
+
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+            INSERT INTO books_fts(rowid, title, author, description)
+            VALUES (new.id, new.title, new.author, new.description);
+        END
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+            INSERT INTO books_fts(books_fts, rowid, title, author, description)
+            VALUES ('delete', old.id, old.title, old.author, old.description);
+        END
+    """))
+    # Срабатывает только при изменении индексируемых полей, а не счетчиков
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS books_fts_update
+        AFTER UPDATE OF title, author, description ON books BEGIN
+            INSERT INTO books_fts(books_fts, rowid, title, author, description)
+            VALUES ('delete', old.id, old.title, old.author, old.description);
+            INSERT INTO books_fts(rowid, title, author, description)
+            VALUES (new.id, new.title, new.author, new.description);
+        END
+    """))
+
+    # Первичное заполнение индекса для уже существующих книг
+    if not fts_existed:
+        conn.execute(text("INSERT INTO books_fts(books_fts) VALUES ('rebuild')"))
+
+def seed_catalog_state(conn: Connection):
+    """Единственная строка со счетчиком поколения каталога"""
+    conn.execute(text("INSERT OR IGNORE INTO catalog_state (id, generation) VALUES (1, 0)"))
+
+def create_library_triggers(conn: Connection):
+    """Версии записей библиотеки и надгробия удаленных для дельта-синхронизации.
+
+    Любое изменение истории или избранного (включая upsert буфера прогресса)
+    увеличивает users.library_version и проставляет новую версию строке.
+    Скрытие и возврат книги в каталог тоже меняют версии ее записей: для клиента
+    это удаление или повторное добавление."""
+    for table, kind in (("listening_history", "history"), ("favorites", "favorite")):
+        version = "(SELECT library_version FROM users WHERE id = new.user_id)"
+        conn.execute(text(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_library_insert AFTER INSERT ON {table} BEGIN
+                UPDATE users SET library_version = library_version + 1 WHERE id = new.user_id;
+                UPDATE {table} SET version = {version} WHERE id = new.id;
+                DELETE FROM library_tombstones
+                WHERE user_id = new.user_id AND kind = '{kind}' AND book_id = new.book_id;
+            END
+        """))
+        conn.execute(text(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_library_delete AFTER DELETE ON {table} BEGIN
+                UPDATE users SET library_version = library_version + 1 WHERE id = old.user_id;
+                INSERT OR REPLACE INTO library_tombstones (user_id, kind, book_id, version)
+                VALUES (
+                    old.user_id, '{kind}', old.book_id,
+                    (SELECT library_version FROM users WHERE id = old.user_id)
+                );
+            END
+        """))
+
+    # Условие WHEN исключает срабатывание на собственную простановку версии
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS listening_history_library_update
+        AFTER UPDATE ON listening_history WHEN new.version = old.version BEGIN
+            UPDATE users SET library_version = library_version + 1 WHERE id = new.user_id;
+            UPDATE listening_history
+            SET version = (SELECT library_version FROM users WHERE id = new.user_id)
+            WHERE id = new.id;
+        END
+    """))
+
+    # Пользователи, у которых книга в истории или избранном, получают новую версию
+    # библиотеки; простановка версии строкам истории не задевает триггер выше
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS books_library_visibility
+        AFTER UPDATE OF is_active ON books WHEN new.is_active IS NOT old.is_active BEGIN
+            UPDATE users SET library_version = library_version + 1
+            WHERE id IN (
+                SELECT user_id FROM listening_history WHERE book_id = new.id
+                UNION
+                SELECT user_id FROM favorites WHERE book_id = new.id
+            );
+            UPDATE listening_history
+            SET version = (SELECT library_version FROM users WHERE id = listening_history.user_id)
+            WHERE book_id = new.id;
+            UPDATE favorites
+            SET version = (SELECT library_version FROM users WHERE id = favorites.user_id)
+            WHERE book_id = new.id;
+        END
+    """))
+
+def _trigger_sql(conn: Connection, name: str) -> Optional[str]:
+    """Текст CREATE TRIGGER из схемы SQLite, None - если триггера нет"""
+    return conn.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = :name"),
+        {"name": name}
+    ).scalar()
+
+def _trigger_exists(conn: Connection, name: str) -> bool:
+    return _trigger_sql(conn, name) is not None
+
+def _rating_stats_sql(alias: str, sign: str) -> str:
+    """Операторы триггера: добавить (+) или вычесть (-) оценку {alias} из агрегатов книги"""
+    histogram = ", ".join(
+        f"count_{value} = count_{value} {sign} ({alias}.rating = {value})" for value in range(1, 6)
+    )
+    return f"""
+        INSERT INTO book_rating_stats
+            (book_id, rating_sum, rating_count, count_1, count_2, count_3, count_4, count_5)
+        SELECT {alias}.book_id, 0, 0, 0, 0, 0, 0, 0
+        WHERE NOT EXISTS (SELECT 1 FROM book_rating_stats WHERE book_id = {alias}.book_id);
+        UPDATE book_rating_stats
+        SET rating_sum = rating_sum {sign} {alias}.rating,
+            rating_count = rating_count {sign} 1,
+            {histogram}
+        WHERE book_id = {alias}.book_id;
+        UPDATE books SET rating = COALESCE((
+            SELECT CAST(rating_sum AS REAL) / NULLIF(rating_count, 0)
+            FROM book_rating_stats WHERE book_id = {alias}.book_id
+        ), 0.0)
+        WHERE id = {alias}.book_id;
+    """
+
+def create_rating_stats(conn: Connection):
+    """Агрегаты оценок (сумма, количество, гистограмма) и books.rating,
+    обновляемые триггерами в той же транзакции, что и запись оценки"""
+    backfill = not _trigger_exists(conn, "ratings_stats_insert")
+
+    # Первая версия триггеров создавала строку через INSERT OR IGNORE, что ломает
+    # upsert оценки (см. create_user_library_stats): такие триггеры пересоздаются,
+    # агрегаты при этом верны и не пересчитываются
+    for name in ("ratings_stats_insert", "ratings_stats_delete", "ratings_stats_update"):
+        if "INSERT OR IGNORE" in (_trigger_sql(conn, name) or ""):
+            conn.execute(text(f"DROP TRIGGER {name}"))
+
+    conn.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS ratings_stats_insert AFTER INSERT ON ratings BEGIN
+            {_rating_stats_sql("new", "+")}
+        END
+    """))
+    conn.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS ratings_stats_delete AFTER DELETE ON ratings BEGIN
+            {_rating_stats_sql("old", "-")}
+        END
+    """))
+    conn.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS ratings_stats_update
+        AFTER UPDATE OF rating, book_id ON ratings BEGIN
+            {_rating_stats_sql("old", "-")}
+            {_rating_stats_sql("new", "+")}
+        END
+    """))
+
+    # Первичное заполнение по уже существующим оценкам
+    if backfill:
+        histogram = ", ".join(f"SUM(rating = {value})" for value in range(1, 6))
+        conn.execute(text("DELETE FROM book_rating_stats"))
+        conn.execute(text(f"""
+            INSERT INTO book_rating_stats
+                (book_id, rating_sum, rating_count, count_1, count_2, count_3, count_4, count_5)
+            SELECT book_id, SUM(rating), COUNT(*), {histogram}
+            FROM ratings GROUP BY book_id
+        """))
+        conn.execute(text("""
+            UPDATE books SET rating = COALESCE((
+                SELECT CAST(rating_sum AS REAL) / NULLIF(rating_count, 0)
+                FROM book_rating_stats WHERE book_id = books.id
+            ), 0.0)
+            WHERE id IN (SELECT book_id FROM book_rating_stats)
+        """))
+
+# Прирост позиции засчитывается как прослушанное время не больше, чем прошло
+# времени между обновлениями плюс этот запас (перемотка вперед не считается)
+LISTEN_DELTA_SLACK_SECONDS = 30
+
+# Прослушанные секунды для новой строки истории и для ее изменения. Прирост
+# позиции ограничен временем между обновлениями: перемотка вперед не увеличивает
+# прослушанное время, перемотка назад не уменьшает
+LISTENED_ON_INSERT_SQL = f"MAX(0, MIN(COALESCE(new.current_position, 0), {LISTEN_DELTA_SLACK_SECONDS}))"
+LISTENED_ON_UPDATE_SQL = f"""MAX(0, MIN(
+    COALESCE(new.current_position, 0) - COALESCE(old.current_position, 0),
+    CAST(COALESCE((julianday(new.last_played) - julianday(old.last_played)) * 86400, 0) AS INTEGER)
+        + {LISTEN_DELTA_SLACK_SECONDS}
+))"""
+
+def create_user_library_stats(conn: Connection):
+    """Статистика библиотеки пользователя, обновляемая триггерами на истории прослушивания"""
+    backfill = not _trigger_exists(conn, "listening_history_stats_insert")
+
+    # Не INSERT OR IGNORE: в триггере, вызванном upsert-ом, SQLite применяет
+    # политику конфликтов внешнего оператора вместо собственной
+    ensure_row = """
+        INSERT INTO user_library_stats (user_id) SELECT {alias}.user_id
+        WHERE NOT EXISTS (SELECT 1 FROM user_library_stats WHERE user_id = {alias}.user_id);
+    """
+    conn.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS listening_history_stats_insert
+        AFTER INSERT ON listening_history BEGIN
+            {ensure_row.format(alias="new")}
+            UPDATE user_library_stats
+            SET total_books = total_books + 1,
+                finished_books = finished_books + COALESCE(new.is_finished, 0),
+                listened_seconds = listened_seconds + {LISTENED_ON_INSERT_SQL}
+            WHERE user_id = new.user_id;
+        END
+    """))
+    conn.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS listening_history_stats_update
+        AFTER UPDATE OF current_position, is_finished, last_played ON listening_history BEGIN
+            {ensure_row.format(alias="new")}
+            UPDATE user_library_stats
+            SET finished_books = finished_books + COALESCE(new.is_finished, 0) - COALESCE(old.is_finished, 0),
+                listened_seconds = listened_seconds + {LISTENED_ON_UPDATE_SQL}
+            WHERE user_id = new.user_id;
+        END
+    """))
+    conn.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS listening_history_stats_delete
+        AFTER DELETE ON listening_history BEGIN
+            UPDATE user_library_stats
+            SET total_books = total_books - 1,
+                finished_books = finished_books - COALESCE(old.is_finished, 0)
+            WHERE user_id = old.user_id;
+        END
+    """))
+
+    # Первая версия вела и счетчик избранного, но в нем учитывались скрытые книги,
+    # а библиотека считает избранное по выдаваемому списку: триггеры и колонка удаляются
+    for name in ("favorites_stats_insert", "favorites_stats_delete"):
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+    columns = {row[1] for row in conn.execute(text("PRAGMA table_info(user_library_stats)"))}
+    if "favorite_count" in columns:
+        conn.execute(text("ALTER TABLE user_library_stats DROP COLUMN favorite_count"))
+
+    # Первичное заполнение; для существующей истории реальное время неизвестно,
+    # поэтому берется сумма позиций, как считалось раньше
+    if backfill:
+        conn.execute(text("DELETE FROM user_library_stats"))
+        conn.execute(text("""
+            INSERT INTO user_library_stats (user_id, total_books, finished_books, listened_seconds)
+            SELECT users.id,
+                   (SELECT COUNT(*) FROM listening_history WHERE user_id = users.id),
+                   (SELECT COUNT(*) FROM listening_history WHERE user_id = users.id AND is_finished = 1),
+                   (SELECT COALESCE(SUM(current_position), 0) FROM listening_history WHERE user_id = users.id)
+            FROM users
+            WHERE users.id IN (SELECT user_id FROM listening_history)
+        """))
+
+def create_listening_events(conn: Connection):
+    """Журнал прослушиваний: строка на каждую запись прогресса в listening_history.
+
+    Буфер прогресса пишет историю пачками, поэтому и события добавляются пачкой
+    в той же транзакции; свертки по дням строит app/analytics.py"""
+    triggers = (
+        ("listening_history_events_insert", "INSERT", LISTENED_ON_INSERT_SQL),
+        ("listening_history_events_update", "UPDATE OF current_position, last_played", LISTENED_ON_UPDATE_SQL),
+    )
+    for name, event, listened in triggers:
+        conn.execute(text(f"""
+            CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON listening_history BEGIN
+                INSERT INTO listening_events (user_id, book_id, position, listened_seconds, occurred_at)
+                VALUES (
+                    new.user_id, new.book_id, COALESCE(new.current_position, 0), {listened},
+                    COALESCE(new.last_played, CURRENT_TIMESTAMP)
+                );
+            END
+        """))
+
+MIGRATIONS = [
+    add_missing_columns,
+    create_missing_indexes,
+    create_books_fts,
+    seed_catalog_state,
+    create_library_triggers,
+    create_rating_stats,
+    create_user_library_stats,
+    create_listening_events,
+]
+
+def run_migrations(engine: Engine):
+    """Применение всех шагов миграции (только для SQLite)"""
+    if engine.dialect.name != "sqlite":
+        return
+
+    with engine.begin() as conn:
+        for step in MIGRATIONS:
+            step(conn)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float, Text, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, ForeignKey, Float, Text, UniqueConstraint, Index, text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from .database import Base
@@ -14,6 +14,8 @@ class User(Base):
     is_premium = Column(Boolean, default=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # Счетчик изменений библиотеки (история, избранное) для дельта-синхронизации
+    library_version = Column(Integer, nullable=False, default=0, server_default="0")
     
     # Relationships
     history = relationship("ListeningHistory", back_populates="user")
@@ -47,8 +49,29 @@ class Category(Base):
     # Relationships
     books = relationship("Book", back_populates="category")
 
+# Колонки, по которым сортируется каталог (см. SortBy в routers/books.py)
+BOOK_SORT_COLUMNS = ("created_at", "plays_count", "rating", "title", "duration_seconds")
+
+def _active_book_indexes():
+    """Частичные индексы по активным книгам: (ключ сортировки, id) и то же с фильтром по категории.
+    
+    id замыкает индекс, поэтому ORDER BY ключ, id и курсорная пагинация
+    обходятся без временного B-дерева для сортировки в обоих направлениях."""
+    indexes = []
+    for column in BOOK_SORT_COLUMNS:
+        indexes.append(Index(
+            f"ix_books_active_{column}", column, "id",
+            sqlite_where=text("is_active = 1")
+        ))
+        indexes.append(Index(
+            f"ix_books_active_category_{column}", "category_id", column, "id",
+            sqlite_where=text("is_active = 1")
+        ))
+    return tuple(indexes)
+
 class Book(Base):
     __tablename__ = "books"
+    __table_args__ = _active_book_indexes()
     
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(200), nullable=False)
@@ -85,13 +108,18 @@ class ListeningHistory(Base):
     last_played = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     is_finished = Column(Boolean, default=False)
     play_count = Column(Integer, default=1)
+    version = Column(Integer, nullable=False, default=0, server_default="0")  # library_version при последнем изменении
     
     # Relationships
     user = relationship("User", back_populates="history")
     book = relationship("Book", back_populates="history")
     
     # Constraints
-    __table_args__ = (UniqueConstraint('user_id', 'book_id'),)
+    __table_args__ = (
+        UniqueConstraint('user_id', 'book_id'),
+        Index("ix_listening_history_user_last_played", "user_id", "last_played", "id"),
+        Index("ix_listening_history_user_version", "user_id", "version"),
+    )
 
 class Bookmark(Base):
     __tablename__ = "bookmarks"
@@ -114,13 +142,18 @@ class Favorite(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     book_id = Column(Integer, ForeignKey("books.id"), nullable=False)
     added_at = Column(DateTime(timezone=True), server_default=func.now())
+    version = Column(Integer, nullable=False, default=0, server_default="0")  # library_version при добавлении
     
     # Relationships
     user = relationship("User", back_populates="favorites")
     book = relationship("Book", back_populates="favorites")
     
     # Constraints
-    __table_args__ = (UniqueConstraint('user_id', 'book_id'),)
+    __table_args__ = (
+        UniqueConstraint('user_id', 'book_id'),
+        Index("ix_favorites_user_added_at", "user_id", "added_at", "id"),
+        Index("ix_favorites_user_version", "user_id", "version"),
+    )
 
 class Rating(Base):
     __tablename__ = "ratings"
@@ -138,4 +171,99 @@ class Rating(Base):
     book = relationship("Book", back_populates="ratings")
     
     # Constraints
-    __table_args__ = (UniqueConstraint('user_id', 'book_id'),) 
\ No newline at end of file
+    __table_args__ = (UniqueConstraint('user_id', 'book_id'),)
+
+class BookRatingStats(Base):
+    """Агрегаты оценок книги, поддерживаемые триггерами на ratings"""
+    __tablename__ = "book_rating_stats"
+    
+    book_id = Column(Integer, ForeignKey("books.id"), primary_key=True)
+    rating_sum = Column(Integer, nullable=False, default=0)
+    rating_count = Column(Integer, nullable=False, default=0)
+    # Гистограмма: количество оценок 1..5
+    count_1 = Column(Integer, nullable=False, default=0)
+    count_2 = Column(Integer, nullable=False, default=0)
+    count_3 = Column(Integer, nullable=False, default=0)
+    count_4 = Column(Integer, nullable=False, default=0)
+    count_5 = Column(Integer, nullable=False, default=0)
+    
+    @property
+    def histogram(self):
+        return [self.count_1, self.count_2, self.count_3, self.count_4, self.count_5]
+
+class UserLibraryStats(Base):
+    """Статистика библиотеки пользователя, поддерживаемая триггерами"""
+    __tablename__ = "user_library_stats"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    total_books = Column(Integer, nullable=False, default=0, server_default="0")
+    finished_books = Column(Integer, nullable=False, default=0, server_default="0")
+    listened_seconds = Column(Integer, nullable=False, default=0, server_default="0")  # По приростам позиции
+
+class ListeningEvent(Base):
+    """Append-only журнал изменений прогресса (пишется триггерами на listening_history)"""
+    __tablename__ = "listening_events"
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    book_id = Column(Integer, nullable=False)
+    position = Column(Integer, nullable=False)
+    listened_seconds = Column(Integer, nullable=False)  # Прирост с предыдущего события
+    occurred_at = Column(DateTime, nullable=False, index=True)
+
+class ListeningDailyBook(Base):
+    """Свертка журнала прослушиваний по дням и книгам"""
+    __tablename__ = "listening_daily_books"
+    
+    day = Column(Date, primary_key=True)
+    book_id = Column(Integer, primary_key=True)
+    listened_seconds = Column(Integer, nullable=False, default=0)
+    listeners = Column(Integer, nullable=False, default=0)
+    events = Column(Integer, nullable=False, default=0)
+
+class ListeningDailyUser(Base):
+    """Свертка журнала прослушиваний по дням и пользователям"""
+    __tablename__ = "listening_daily_users"
+    
+    day = Column(Date, primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    listened_seconds = Column(Integer, nullable=False, default=0)
+    books = Column(Integer, nullable=False, default=0)
+    events = Column(Integer, nullable=False, default=0)
+
+class RollupState(Base):
+    """Водяной знак свертки: последнее учтенное событие журнала"""
+    __tablename__ = "rollup_state"
+    
+    name = Column(String(50), primary_key=True)
+    last_event_id = Column(Integer, nullable=False, default=0)
+
+class RevokedToken(Base):
+    """Отозванный JWT (по claim jti); строка не нужна после истечения токена"""
+    __tablename__ = "revoked_tokens"
+    
+    id = Column(Integer, primary_key=True)  # Порядок отзыва для инкрементальной синхронизации воркеров
+    jti = Column(String(32), unique=True, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    revoked_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class CatalogState(Base):
+    __tablename__ = "catalog_state"
+    
+    id = Column(Integer, primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)  # Растет при изменениях каталога админом
+
+class LibraryTombstone(Base):
+    """Удаленная запись библиотеки для дельта-синхронизации клиента"""
+    __tablename__ = "library_tombstones"
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    kind = Column(String(20), nullable=False)  # "history" или "favorite"
+    book_id = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False)  # library_version при удалении
+    
+    __table_args__ = (
+        UniqueConstraint('user_id', 'kind', 'book_id'),
+        Index("ix_library_tombstones_user_version", "user_id", "kind", "version"),
+    )
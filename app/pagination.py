@@ -0,0 +1,70 @@
+import base64
+import binascii
+import json
+from typing import Any, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, tuple_
+
+def encode_cursor(sort_key: Any, item_id: int, scope: Optional[str] = None) -> str:
+    """Курсор: значение ключа сортировки как оно хранится в БД и id строки.
+
+    scope (например, вариант сортировки) не дает применить курсор к другому порядку"""
+    payload = [sort_key, item_id] if scope is None else [scope, sort_key, item_id]
+    data = json.dumps(payload, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, scope: Optional[str] = None) -> Tuple[Any, int]:
+    """Разбор курсора, выданного encode_cursor с тем же scope"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        if scope is None:
+            sort_key, item_id = payload
+        else:
+            cursor_scope, sort_key, item_id = payload
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if scope is not None and cursor_scope != scope:
+        raise HTTPException(status_code=400, detail="Cursor does not match sort order")
+    if not isinstance(item_id, int) or not (sort_key is None or isinstance(sort_key, (str, int, float))):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    return sort_key, item_id
+
+def keyset_segments(sort_key, descending: bool, last_key: Any, last_id: int, id_column) -> List[Any]:
+    """Условия для строк строго после (last_key, last_id), по сегментам в порядке выдачи.
+
+    SQLite ставит NULL первыми при ASC и последними при DESC. Сравнение row value
+    с NULL не работает, поэтому строки с NULL в ключе - отдельный сегмент.
+    Каждое условие SQLite выполняет поиском по индексу (sort_key, id), без сканирования."""
+    if descending:
+        nulls_after = and_(sort_key.is_(None), id_column < last_id)
+        if last_key is None:
+            return [nulls_after]
+        return [tuple_(sort_key, id_column) < tuple_(last_key, last_id), sort_key.is_(None)]
+
+    if last_key is None:
+        return [and_(sort_key.is_(None), id_column > last_id), sort_key.isnot(None)]
+    return [tuple_(sort_key, id_column) > tuple_(last_key, last_id)]
+
+def fetch_after(query, sort_key, descending: bool, cursor_position: Tuple[Any, int], id_column, limit: int) -> list:
+    """До limit + 1 строк после позиции курсора (лишняя строка - признак следующей страницы).
+
+    Запрос уже упорядочен по (sort_key, id_column) и возвращает ключ в колонке sort_key"""
+    last_key, last_id = cursor_position
+    rows = []
+    for condition in keyset_segments(sort_key, descending, last_key, last_id, id_column):
+        rows += query.filter(condition).limit(limit + 1 - len(rows)).all()
+        if len(rows) > limit:
+            break
+    return rows
+
+def page_rows(rows: list, limit: int, scope: Optional[str] = None) -> Tuple[list, Optional[str]]:
+    """Объекты страницы из строк (объект, sort_key) и курсор следующей страницы"""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].sort_key, rows[-1][0].id, scope)
+    return [row[0] for row in rows], next_cursor
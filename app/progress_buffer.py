@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, NamedTuple, Optional
+
+from sqlalchemy import bindparam, case, func, select, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .config import settings
+from .database import SessionLocal, upsert
+from .models import Book, ListeningHistory
+
+logger = logging.getLogger(__name__)
+
+# Доля прослушанного, после которой книга считается завершенной
+FINISHED_RATIO = 0.95
+
+class PendingProgress(NamedTuple):
+    position: int
+    duration: int
+    first_played: datetime  # Первое обновление, попавшее в буфер
+    last_played: datetime
+    sessions: int  # Сеансы, начавшиеся внутри буфера после первого обновления
+
+def pending_is_finished(item: PendingProgress, was_finished: bool) -> bool:
+    """Статус завершения после записи прогресса: при нулевой длительности не меняется"""
+    if item.duration > 0:
+        return item.position >= item.duration * FINISHED_RATIO
+    return was_finished
+
+def session_gap() -> timedelta:
+    """Пауза, после которой прослушивание считается новым сеансом"""
+    return timedelta(seconds=settings.play_session_gap)
+
+def merge_progress(a: PendingProgress, b: PendingProgress) -> PendingProgress:
+    """Объединение двух записей прогресса одной книги: позиция - из более поздней"""
+    older, newer = (a, b) if a.last_played <= b.last_played else (b, a)
+    new_session = newer.first_played - older.last_played > session_gap()
+    return newer._replace(
+        first_played=min(older.first_played, newer.first_played),
+        sessions=older.sessions + newer.sessions + new_session
+    )
+
+class ProgressBuffer:
+    """Буфер отложенной записи прогресса прослушивания.
+
+    Плеер присылает прогресс каждые ~10 секунд, часто дублируя запросы. Буфер
+    хранит только последнюю позицию для пары (пользователь, книга) и записывает
+    накопленное пачкой upsert-ов в одной транзакции: по таймеру, при переполнении
+    и при остановке приложения. Буфер живет в памяти воркера, поэтому чтения
+    прогресса пользователя сначала сбрасывают его записи (flush_user) или, если
+    объекты запроса уже загружены, накладывают их поверх истории (peek_user)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: Dict[int, Dict[int, PendingProgress]] = {}
+        self._size = 0
+
+    def add(self, user_id: int, book_id: int, position: int, duration: int):
+        """Добавление обновления прогресса; предыдущее для той же книги перезаписывается"""
+        now = datetime.utcnow()
+        with self._lock:
+            user_pending = self._pending.setdefault(user_id, {})
+            previous = user_pending.get(book_id)
+            if previous is None:
+                self._size += 1
+                user_pending[book_id] = PendingProgress(position, duration, now, now, 0)
+                return
+            new_session = now - previous.last_played > session_gap()
+            user_pending[book_id] = previous._replace(
+                position=position,
+                duration=duration,
+                last_played=now,
+                sessions=previous.sessions + new_session
+            )
+
+    def peek(self, user_id: int, book_id: int) -> Optional[PendingProgress]:
+        with self._lock:
+            return self._pending.get(user_id, {}).get(book_id)
+
+    def peek_user(self, user_id: int) -> Dict[int, PendingProgress]:
+        """Копия незаписанного прогресса пользователя по книгам (без записи в БД)"""
+        with self._lock:
+            return dict(self._pending.get(user_id, {}))
+
+    def discard(self, user_id: int, book_id: int):
+        """Отбросить незаписанный прогресс (например, книга отмечена прослушанной)"""
+        with self._lock:
+            user_pending = self._pending.get(user_id)
+            if user_pending and user_pending.pop(book_id, None) is not None:
+                self._size -= 1
+                if not user_pending:
+                    del self._pending[user_id]
+
+    def is_full(self) -> bool:
+        return self._size >= settings.progress_buffer_max_pending
+
+    def __len__(self) -> int:
+        return self._size
+
+    def flush(self, db: Session) -> int:
+        """Запись всего буфера; возвращает количество записанных пар"""
+        with self._lock:
+            pending, self._pending, self._size = self._pending, {}, 0
+        return self._write(db, pending)
+
+    def flush_user(self, db: Session, user_id: int) -> int:
+        """Запись буфера одного пользователя перед чтением его прогресса из БД"""
+        with self._lock:
+            user_pending = self._pending.pop(user_id, None)
+            if not user_pending:
+                return 0
+            self._size -= len(user_pending)
+        return self._write(db, {user_id: user_pending})
+
+    def write(self, db: Session, user_id: int, entries: Dict[int, PendingProgress]) -> int:
+        """Немедленная запись прогресса пользователя вместе с его буфером в одной транзакции"""
+        with self._lock:
+            merged = self._pending.pop(user_id, {})
+            self._size -= len(merged)
+        for book_id, item in entries.items():
+            current = merged.get(book_id)
+            merged[book_id] = item if current is None else merge_progress(current, item)
+        return self._write(db, {user_id: merged})
+
+    def _restore(self, pending: Dict[int, Dict[int, PendingProgress]]):
+        """Возврат незаписанного в буфер; пришедшие за это время обновления новее"""
+        with self._lock:
+            for user_id, user_pending in pending.items():
+                current = self._pending.setdefault(user_id, {})
+                for book_id, item in user_pending.items():
+                    newer = current.get(book_id)
+                    if newer is None:
+                        self._size += 1
+                    current[book_id] = item if newer is None else merge_progress(item, newer)
+
+    def _write(self, db: Session, pending: Dict[int, Dict[int, PendingProgress]]) -> int:
+        try:
+            return self._upsert(db, pending)
+        except Exception:
+            db.rollback()
+            self._restore(pending)
+            raise
+
+    def _upsert(self, db: Session, pending: Dict[int, Dict[int, PendingProgress]]) -> int:
+        if not pending:
+            return 0
+        book_ids = {book_id for user_pending in pending.values() for book_id in user_pending}
+        
+        # Книга могла быть удалена, пока прогресс ждал записи
+        existing_books = set(db.scalars(select(Book.id).where(Book.id.in_(book_ids))))
+        
+        # Время последнего прослушивания из БД определяет, начат ли новый сеанс
+        last_played = {
+            (user_id, book_id): played
+            for user_id, book_id, played in db.query(
+                ListeningHistory.user_id, ListeningHistory.book_id, ListeningHistory.last_played
+            ).filter(
+                ListeningHistory.user_id.in_(pending.keys()),
+                ListeningHistory.book_id.in_(existing_books)
+            )
+        }
+        
+        rows = []
+        book_plays: Dict[int, int] = {}
+        for user_id, user_pending in pending.items():
+            for book_id, item in user_pending.items():
+                if book_id not in existing_books:
+                    continue
+                previous = last_played.get((user_id, book_id))
+                sessions = item.sessions + (
+                    previous is None or item.first_played - previous.replace(tzinfo=None) > session_gap()
+                )
+                if sessions:
+                    book_plays[book_id] = book_plays.get(book_id, 0) + sessions
+                rows.append({
+                    "user_id": user_id,
+                    "book_id": book_id,
+                    "current_position": item.position,
+                    "total_duration": item.duration,
+                    "last_played": item.last_played,
+                    "is_finished": pending_is_finished(item, False),
+                    "play_count": sessions,
+                })
+        if not rows:
+            return 0
+        
+        stmt = upsert(db, ListeningHistory)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ListeningHistory.user_id, ListeningHistory.book_id],
+            set_={
+                "current_position": stmt.excluded.current_position,
+                "total_duration": stmt.excluded.total_duration,
+                "last_played": stmt.excluded.last_played,
+                # При нулевой длительности статус завершения не меняется
+                "is_finished": case(
+                    (stmt.excluded.total_duration > 0, stmt.excluded.is_finished),
+                    else_=ListeningHistory.is_finished
+                ),
+                "play_count": ListeningHistory.play_count + stmt.excluded.play_count,
+            },
+            # Более позднее действие (например, отметка о завершении) не перезаписывается
+            where=stmt.excluded.last_played >= ListeningHistory.last_played
+        )
+        db.execute(stmt, rows)
+        
+        # Прослушивания книги - число начатых сеансов, атомарным инкрементом в SQL
+        if book_plays:
+            books = Book.__table__
+            db.execute(
+                update(books)
+                .where(books.c.id == bindparam("target_id"))
+                .values(plays_count=func.coalesce(books.c.plays_count, 0) + bindparam("plays")),
+                [{"target_id": book_id, "plays": plays} for book_id, plays in book_plays.items()]
+            )
+        db.commit()
+        return len(rows)
+
+progress_buffer = ProgressBuffer()
+
+def flush_progress_buffer():
+    """Запись буфера в отдельной сессии (для фоновой задачи и остановки приложения)"""
+    db = SessionLocal()
+    try:
+        return progress_buffer.flush(db)
+    finally:
+        db.close()
+
+async def run_progress_flusher():
+    """Фоновая задача: периодическая запись буфера прогресса"""
+    while True:
+        await asyncio.sleep(settings.progress_flush_interval)
+        try:
+            await run_in_threadpool(flush_progress_buffer)
+        except Exception:
+            logger.exception("Failed to flush listening progress")
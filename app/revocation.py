@@ -0,0 +1,114 @@
+import hashlib
+import math
+import time
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .database import upsert
+from .models import RevokedToken
+
+class BloomFilter:
+    """Фильтр Блума по строкам: отсутствие элемента определяется точно,
+    присутствие - с долей ложных срабатываний error_rate при заполнении до capacity"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self._size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self._hashes = max(1, round(self._size / capacity * math.log(2)))
+        self._bits = bytearray((self._size + 7) // 8)
+        self._count = 0
+
+    def _positions(self, item: str):
+        # Двойное хэширование: k позиций из двух 64-битных половин одного дайджеста
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self._hashes):
+            yield (h1 + i * h2) % self._size
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self._count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def __len__(self) -> int:
+        return self._count
+
+class RevocationList:
+    """Отозванные токены: таблица revoked_tokens и фильтр Блума в памяти воркера.
+
+    Токен, которого нет в фильтре, точно не отозван, и проверка обходится без БД;
+    совпадение подтверждается запросом по jti. Воркер подгружает строки, отозванные
+    в других воркерах, инкрементально по id не чаще раза в
+    settings.revocation_sync_interval секунд - на это время отзыв может запаздывать.
+    При переполнении фильтр перестраивается по еще не истекшим токенам."""
+
+    def __init__(self):
+        self._bloom: Optional[BloomFilter] = None
+        self._last_id = 0
+        self._synced_at = 0.0
+
+    def _rebuild(self, db: Session):
+        # Граница читается первой: строки, добавленные после, придут инкрементально
+        last_id = db.query(RevokedToken.id).order_by(RevokedToken.id.desc()).limit(1).scalar() or 0
+        rows = db.query(RevokedToken.id, RevokedToken.jti).filter(
+            RevokedToken.id <= last_id,
+            RevokedToken.expires_at > datetime.utcnow()
+        ).all()
+        bloom = BloomFilter(
+            capacity=max(settings.revocation_bloom_capacity, 2 * len(rows)),
+            error_rate=settings.revocation_bloom_error_rate
+        )
+        for _, jti in rows:
+            bloom.add(jti)
+        self._bloom, self._last_id = bloom, last_id
+
+    def sync(self, db: Session):
+        now = time.monotonic()
+        if self._bloom is not None and now - self._synced_at < settings.revocation_sync_interval:
+            return
+        if self._bloom is None:
+            self._rebuild(db)
+        else:
+            rows = db.query(RevokedToken.id, RevokedToken.jti).filter(
+                RevokedToken.id > self._last_id
+            ).order_by(RevokedToken.id).all()
+            if len(self._bloom) + len(rows) > self._bloom.capacity:
+                self._rebuild(db)
+            else:
+                for row_id, jti in rows:
+                    self._bloom.add(jti)
+                    self._last_id = row_id
+        self._synced_at = now
+
+    def is_revoked(self, db: Session, jti: Optional[str]) -> bool:
+        # Токены, выданные до появления jti, отозвать нельзя: они истекают сами
+        if not jti:
+            return False
+        self.sync(db)
+        if jti not in self._bloom:
+            return False
+        return db.query(RevokedToken.id).filter(RevokedToken.jti == jti).first() is not None
+
+    def revoke(self, db: Session, jti: str, expires_at: datetime):
+        """Отзыв токена; в этом воркере действует сразу, в остальных - после синхронизации"""
+        db.execute(
+            upsert(db, RevokedToken)
+            .values(jti=jti, expires_at=expires_at)
+            .on_conflict_do_nothing(index_elements=[RevokedToken.jti])
+        )
+        # Истекшие токены отклоняются при разборе JWT, их строки больше не нужны
+        db.query(RevokedToken).filter(
+            RevokedToken.expires_at <= datetime.utcnow()
+        ).delete(synchronize_session=False)
+        db.commit()
+        self._synced_at = 0.0
+        self.sync(db)
+
+revocation_list = RevocationList()
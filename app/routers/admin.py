@@ -1,48 +1,68 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Request
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import func, desc
-from passlib.context import CryptContext
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import List, Optional
 
 from ..database import get_db
 from ..schemas import (
     AdminLogin, AdminToken, AdminResponse, DashboardResponse, DashboardStats,
     BookCreate, BookUpdate, BookResponse, CategoryCreate, CategoryResponse,
-    StatusResponse, UserResponse
+    StatusResponse, UserResponse, DailyListening, BookListening, ListeningAnalyticsResponse
 )
-from ..models import Admin, User, Book, Category, ListeningHistory
+from ..models import Admin, User, Book, Category, ListeningHistory, ListeningDailyBook, ListeningDailyUser
 from ..dependencies import get_current_admin, get_superadmin
 from ..auth import create_admin_token
 from ..utils import save_and_optimize_image, save_audio_file, delete_file
+from ..suggest import suggest_index
+from ..cache import catalog_version
 from ..config import settings
+from ..passwords import verify_password
+from ..throttle import AttemptThrottle
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+# Ограничение попыток входа: перебор паролей не должен загружать процессор bcrypt-ом
+login_throttle_by_username = AttemptThrottle(
+    max_attempts=settings.admin_login_attempts_per_username,
+    window=settings.admin_login_window,
+    maxsize=settings.admin_login_throttle_size
+)
+login_throttle_by_ip = AttemptThrottle(
+    max_attempts=settings.admin_login_attempts_per_ip,
+    window=settings.admin_login_window,
+    maxsize=settings.admin_login_throttle_size
+)
 
 @router.post("/login", response_model=AdminToken)
 async def admin_login(
     credentials: AdminLogin,
+    request: Request,
     db: Session = Depends(get_db)
 ):
     """Авторизация администратора"""
     
+    client_ip = request.client.host if request.client else "unknown"
+    retry_after = login_throttle_by_ip.hit(client_ip) or login_throttle_by_username.hit(credentials.username)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many login attempts",
+            headers={"Retry-After": str(retry_after)}
+        )
+    
     admin = db.query(Admin).filter(
         Admin.username == credentials.username,
         Admin.is_active == True
     ).first()
     
-    if not admin or not verify_password(credentials.password, admin.password_hash):
+    if not admin or not await verify_password(credentials.password, admin.password_hash):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
+    login_throttle_by_username.reset(credentials.username)
+    
     # Обновляем время последнего входа
     admin.last_login = datetime.utcnow()
     db.commit()
@@ -65,7 +85,8 @@ async def get_dashboard(
     # Статистика
     total_users = db.query(User).count()
     total_books = db.query(Book).filter(Book.is_active == True).count()
-    total_plays = db.query(func.sum(ListeningHistory.play_count)).scalar() or 0
+    # Прослушивания - начатые сеансы, накопленные в books.plays_count
+    total_plays = db.query(func.sum(Book.plays_count)).scalar() or 0
     
     # Новые пользователи сегодня
     today = datetime.utcnow().date()
@@ -73,20 +94,28 @@ async def get_dashboard(
         func.date(User.created_at) == today
     ).count()
     
+    # Время прослушивания за сегодня - из дневных сверток (app/analytics.py)
+    listened_today, listeners_today = db.query(
+        func.coalesce(func.sum(ListeningDailyUser.listened_seconds), 0),
+        func.count(ListeningDailyUser.user_id)
+    ).filter(ListeningDailyUser.day == today).one()
+    
     stats = DashboardStats(
         total_users=total_users,
         total_books=total_books,
         total_plays=total_plays,
-        new_users_today=new_users_today
+        new_users_today=new_users_today,
+        listened_seconds_today=listened_today,
+        listeners_today=listeners_today
     )
     
     # Последние книги
-    recent_books = db.query(Book).filter(
+    recent_books = db.query(Book).options(joinedload(Book.category)).filter(
         Book.is_active == True
     ).order_by(desc(Book.created_at)).limit(5).all()
     
     # Популярные книги
-    popular_books = db.query(Book).filter(
+    popular_books = db.query(Book).options(joinedload(Book.category)).filter(
         Book.is_active == True
     ).order_by(desc(Book.plays_count)).limit(5).all()
     
@@ -96,6 +125,48 @@ async def get_dashboard(
         popular_books=[BookResponse.model_validate(book) for book in popular_books]
     )
 
+@router.get("/analytics/listening", response_model=ListeningAnalyticsResponse)
+async def get_listening_analytics(
+    days: int = Query(30, ge=1, le=365, description="Период в днях"),
+    limit: int = Query(10, ge=1, le=100, description="Количество книг в топе"),
+    db: Session = Depends(get_db),
+    admin: Admin = Depends(get_current_admin)
+):
+    """Время прослушивания по дням и топ книг из дневных сверток (app/analytics.py)"""
+    
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    
+    daily = db.query(
+        ListeningDailyUser.day,
+        func.sum(ListeningDailyUser.listened_seconds),
+        func.count(ListeningDailyUser.user_id)
+    ).filter(
+        ListeningDailyUser.day >= since
+    ).group_by(ListeningDailyUser.day).order_by(ListeningDailyUser.day).all()
+    
+    listened = func.sum(ListeningDailyBook.listened_seconds)
+    top_books = db.query(
+        ListeningDailyBook.book_id,
+        Book.title,
+        listened,
+        func.sum(ListeningDailyBook.listeners)
+    ).join(
+        Book, Book.id == ListeningDailyBook.book_id
+    ).filter(
+        ListeningDailyBook.day >= since
+    ).group_by(ListeningDailyBook.book_id, Book.title).order_by(desc(listened)).limit(limit).all()
+    
+    return ListeningAnalyticsResponse(
+        days=[
+            DailyListening(day=day, listened_seconds=seconds, listeners=listeners)
+            for day, seconds, listeners in daily
+        ],
+        top_books=[
+            BookListening(book_id=book_id, title=title, listened_seconds=seconds, listener_days=listener_days)
+            for book_id, title, seconds, listener_days in top_books
+        ]
+    )
+
 @router.post("/books", response_model=BookResponse)
 async def create_book(
     title: str = Form(...),
@@ -137,12 +208,14 @@ async def create_book(
     db.add(book)
     db.commit()
     db.refresh(book)
+    suggest_index.update_book(book)
     
     # Обновляем счетчик книг в категории
     category.books_count = db.query(Book).filter(
         Book.category_id == category_id,
         Book.is_active == True
     ).count()
+    catalog_version.bump(db)
     db.commit()
     
     return BookResponse.model_validate(book)
@@ -150,14 +223,14 @@ async def create_book(
 @router.get("/books", response_model=List[BookResponse])
 async def get_admin_books(
     page: int = Query(1, ge=1),
-    limit: int = Query(20, le=100),
+    limit: int = Query(20, ge=1, le=100),
     search: Optional[str] = Query(None),
     db: Session = Depends(get_db),
     admin: Admin = Depends(get_current_admin)
 ):
     """Получение списка книг для админ панели"""
     
-    query = db.query(Book)
+    query = db.query(Book).options(joinedload(Book.category))
     
     if search:
         search_term = f"%{search}%"
@@ -199,8 +272,10 @@ async def update_book(
         book.is_active = book_data.is_active
     
     book.updated_at = datetime.utcnow()
+    catalog_version.bump(db)
     db.commit()
     db.refresh(book)
+    suggest_index.update_book(book)
     
     return BookResponse.model_validate(book)
 
@@ -224,7 +299,9 @@ async def delete_book(
     
     # Удаление из БД
     db.delete(book)
+    catalog_version.bump(db)
     db.commit()
+    suggest_index.remove_book(book_id)
     
     return StatusResponse(status="deleted", message=f"Book {book_id} deleted")
 
@@ -243,6 +320,7 @@ async def create_category(
     
     category = Category(**category_data.model_dump())
     db.add(category)
+    catalog_version.bump(db)
     db.commit()
     db.refresh(category)
     
@@ -260,7 +338,7 @@ async def get_admin_categories(
 @router.get("/users", response_model=List[UserResponse])
 async def get_admin_users(
     page: int = Query(1, ge=1),
-    limit: int = Query(50, le=100),
+    limit: int = Query(50, ge=1, le=100),
     db: Session = Depends(get_db),
     admin: Admin = Depends(get_current_admin)
 ):
@@ -297,6 +375,7 @@ async def setup_demo_data(
                 category = Category(**cat_data)
                 db.add(category)
         
+        catalog_version.bump(db)
         db.commit()
         
         return StatusResponse(
@@ -311,14 +390,14 @@ async def setup_demo_data(
 @router.get("/books", response_model=List[BookResponse])
 async def get_admin_books(
     page: int = Query(1, ge=1),
-    limit: int = Query(50, le=100),
+    limit: int = Query(50, ge=1, le=100),
     db: Session = Depends(get_db),
     admin: Admin = Depends(get_current_admin)
 ):
     """Получение списка книг для админа"""
     
     offset = (page - 1) * limit
-    books = db.query(Book).offset(offset).limit(limit).all()
+    books = db.query(Book).options(joinedload(Book.category)).offset(offset).limit(limit).all()
     
     return [BookResponse.model_validate(book) for book in books]
 
@@ -339,8 +418,10 @@ async def update_book(
     for field, value in book_update.model_dump(exclude_unset=True).items():
         setattr(book, field, value)
     
+    catalog_version.bump(db)
     db.commit()
     db.refresh(book)
+    suggest_index.update_book(book)
     
     return BookResponse.model_validate(book)
 
@@ -385,7 +466,9 @@ async def delete_book(
     
     # Удаляем книгу
     db.delete(book)
+    catalog_version.bump(db)
     db.commit()
+    suggest_index.remove_book(book_id)
     
     return StatusResponse(status="success", message="Book deleted successfully")
 
@@ -402,7 +485,9 @@ async def toggle_book_status(
         raise HTTPException(status_code=404, detail="Book not found")
     
     book.is_active = not book.is_active
+    catalog_version.bump(db)
     db.commit()
     db.refresh(book)
+    suggest_index.update_book(book)
     
     return BookResponse.model_validate(book) 
\ No newline at end of file
@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials
+from jose import JWTError
 from sqlalchemy.orm import Session
 
 from ..database import get_db
-from ..schemas import TelegramAuth, Token, UserResponse
-from ..auth import validate_telegram_data, create_access_token
+from ..schemas import TelegramAuth, Token, UserResponse, StatusResponse
+from ..auth import validate_telegram_data, create_access_token, invalidate_user, revoke_token, security
 from ..models import User
 from ..config import settings
 
@@ -44,11 +46,17 @@ async def telegram_auth(auth_data: TelegramAuth, db: Session = Depends(get_db)):
         db.commit()
         db.refresh(user)
     else:
-        # Обновление данных существующего пользователя
-        user.username = user_data.get("username")
-        user.first_name = user_data.get("first_name")
-        user.last_name = user_data.get("last_name")
-        db.commit()
+        # Обновление данных существующего пользователя, только если они изменились
+        profile = {
+            "username": user_data.get("username"),
+            "first_name": user_data.get("first_name"),
+            "last_name": user_data.get("last_name")
+        }
+        if any(getattr(user, field) != value for field, value in profile.items()):
+            for field, value in profile.items():
+                setattr(user, field, value)
+            db.commit()
+            invalidate_user(user.id)
     
     # Создание JWT токена
     access_token = create_access_token(data={"sub": str(user.id)})
@@ -57,4 +65,22 @@ async def telegram_auth(auth_data: TelegramAuth, db: Session = Depends(get_db)):
         "access_token": access_token,
         "token_type": "bearer",
         "user": UserResponse.model_validate(user)
-    } 
\ No newline at end of file
+    }
+
+@router.post("/logout", response_model=StatusResponse)
+async def logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db)
+):
+    """Выход: отзыв переданного токена (пользователя или администратора)"""
+    
+    try:
+        revoke_token(db, credentials.credentials)
+    except JWTError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    return StatusResponse(status="success", message="Token revoked")
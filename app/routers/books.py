@@ -1,13 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import func, or_, desc, asc
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import func, desc, asc, case, type_coerce
+from sqlalchemy.types import NullType
+from typing import Dict, List, NamedTuple, Optional, Tuple
 from enum import Enum
 
 from ..database import get_db
-from ..schemas import BookResponse, BooksListResponse, SearchResponse, UserProgress
+from ..cache import (
+    LRUCache, anonymous_cache_key, cache_response, catalog_version, get_cached_response
+)
+from ..config import settings
+from ..pagination import decode_cursor, fetch_after, page_rows
+from ..schemas import (
+    BookResponse, BooksListResponse, CategoryFacet, FacetsResponse, FreeFacet, RangeFacet,
+    SearchResponse, SuggestItem, SuggestResponse, UserProgress
+)
 from ..models import Book, Category, ListeningHistory, Favorite, User
-from ..dependencies import get_current_user, get_optional_user
+from ..dependencies import get_optional_user
+from ..progress_buffer import pending_is_finished, progress_buffer
+from ..search import search_book_ids
+from ..serialization import JSONBytesResponse, book_json, books_json, dumps
+from ..suggest import suggest_index
 
 router = APIRouter(prefix="/api/books", tags=["books"])
 
@@ -20,109 +33,372 @@ class SortBy(str, Enum):
     duration_short = "duration_short"
     duration_long = "duration_long"
 
-def get_user_progress(book: Book, user: Optional[User], db: Session) -> Optional[UserProgress]:
-    """Получение прогресса пользователя для книги"""
-    if not user:
-        return None
+# Колонка и направление (True - по убыванию) для каждого варианта сортировки.
+# Book.id всегда добавляется вторым ключом, чтобы порядок был однозначным
+SORT_KEYS = {
+    SortBy.newest: (Book.created_at, True),
+    SortBy.oldest: (Book.created_at, False),
+    SortBy.popular: (Book.plays_count, True),
+    SortBy.rating: (Book.rating, True),
+    SortBy.alphabetical: (Book.title, False),
+    SortBy.duration_short: (Book.duration_seconds, False),
+    SortBy.duration_long: (Book.duration_seconds, True),
+}
+
+def get_users_progress(books: List[Book], user: Optional[User], db: Session) -> Dict[int, UserProgress]:
+    """Получение прогресса пользователя сразу для набора книг (два запроса на страницу).
+    
+    Незаписанный прогресс из буфера накладывается поверх истории без записи в БД:
+    коммит в GET-запросе сделал бы загруженные книги устаревшими."""
+    if not user or not books:
+        return {}
+    
+    pending = progress_buffer.peek_user(user.id)
+    book_ids = [book.id for book in books]
     
     # История прослушивания
-    history = db.query(ListeningHistory).filter(
-        ListeningHistory.user_id == user.id,
-        ListeningHistory.book_id == book.id
-    ).first()
+    history_by_book = {
+        history.book_id: history
+        for history in db.query(ListeningHistory).filter(
+            ListeningHistory.user_id == user.id,
+            ListeningHistory.book_id.in_(book_ids)
+        )
+    }
     
     # Избранное
-    favorite = db.query(Favorite).filter(
-        Favorite.user_id == user.id,
-        Favorite.book_id == book.id
-    ).first()
+    favorite_book_ids = {
+        book_id
+        for (book_id,) in db.query(Favorite.book_id).filter(
+            Favorite.user_id == user.id,
+            Favorite.book_id.in_(book_ids)
+        )
+    }
     
-    return UserProgress(
-        current_position=history.current_position if history else 0,
-        is_finished=history.is_finished if history else False,
-        is_favorite=bool(favorite),
-        last_played=history.last_played if history else None
-    )
+    progress = {}
+    for book_id in book_ids:
+        history = history_by_book.get(book_id)
+        item = pending.get(book_id)
+        # Как и при записи буфера, более позднее действие в истории не перекрывается
+        if item is not None and (
+            history is None or history.last_played is None
+            or item.last_played >= history.last_played.replace(tzinfo=None)
+        ):
+            progress[book_id] = UserProgress(
+                current_position=item.position,
+                is_finished=pending_is_finished(item, history.is_finished if history else False),
+                is_favorite=book_id in favorite_book_ids,
+                last_played=item.last_played
+            )
+            continue
+        progress[book_id] = UserProgress(
+            current_position=history.current_position if history else 0,
+            is_finished=history.is_finished if history else False,
+            is_favorite=book_id in favorite_book_ids,
+            last_played=history.last_played if history else None
+        )
+    return progress
 
-@router.get("", response_model=BooksListResponse)
-async def get_books(
+def get_user_progress(book: Book, user: Optional[User], db: Session) -> Optional[UserProgress]:
+    """Получение прогресса пользователя для книги"""
+    return get_users_progress([book], user, db).get(book.id)
+
+class BookFilters(NamedTuple):
+    """Нормализованный набор фильтров каталога (используется и как ключ кэша)"""
+    category_id: Optional[int]
+    is_free: Optional[bool]
+    min_rating: Optional[float]
+    min_duration: Optional[int]
+    max_duration: Optional[int]
+    author: Optional[str]
+
+def get_book_filters(
     category_id: Optional[int] = Query(None, description="ID категории"),
     is_free: Optional[bool] = Query(None, description="Только бесплатные книги"),
     min_rating: Optional[float] = Query(None, ge=0, le=5, description="Минимальный рейтинг"),
     min_duration: Optional[int] = Query(None, ge=0, description="Минимальная длительность в секундах"),
     max_duration: Optional[int] = Query(None, ge=0, description="Максимальная длительность в секундах"),
-    author: Optional[str] = Query(None, description="Поиск по автору"),
+    author: Optional[str] = Query(None, description="Поиск по автору")
+) -> BookFilters:
+    """Фильтры каталога из query-параметров"""
+    # Регистр не нормализуется: lower() в SQLite не знает кириллицу
+    author = author.strip() if author else None
+    return BookFilters(
+        category_id=category_id or None,
+        is_free=is_free,
+        min_rating=min_rating,
+        min_duration=min_duration,
+        max_duration=max_duration,
+        author=author or None
+    )
+
+def apply_book_filters(query, filters: BookFilters):
+    """Применение фильтров каталога к запросу по Book"""
+    if filters.category_id:
+        query = query.filter(Book.category_id == filters.category_id)
+    
+    if filters.is_free is not None:
+        query = query.filter(Book.is_free == filters.is_free)
+    
+    if filters.min_rating is not None:
+        query = query.filter(Book.rating >= filters.min_rating)
+    
+    if filters.min_duration is not None:
+        query = query.filter(Book.duration_seconds >= filters.min_duration)
+    
+    if filters.max_duration is not None:
+        query = query.filter(Book.duration_seconds <= filters.max_duration)
+    
+    if filters.author:
+        query = query.filter(Book.author.ilike(f"%{filters.author}%"))
+    
+    return query
+
+# Количество активных книг по набору фильтров; ключ - (поколение каталога, фильтры)
+count_cache = LRUCache(maxsize=settings.count_cache_size, ttl=settings.count_cache_ttl)
+
+def count_books(db: Session, filters: BookFilters) -> int:
+    """Количество активных книг под фильтрами с кэшированием"""
+    key = (catalog_version.get(db), filters)
+    total = count_cache.get(key)
+    if total is None:
+        total = apply_book_filters(db.query(Book).filter(Book.is_active == True), filters).count()
+        count_cache.set(key, total)
+    return total
+
+def fetch_catalog_page(
+    db: Session,
+    filters: BookFilters,
+    sort_by: SortBy,
+    limit: int,
+    offset: int = 0,
+    cursor: Optional[str] = None
+) -> Tuple[List[Book], Optional[int], Optional[str]]:
+    """Страница каталога: книги, total (None в курсорном режиме) и курсор следующей страницы"""
+    query = db.query(Book).options(joinedload(Book.category)).filter(Book.is_active == True)
+    query = apply_book_filters(query, filters)
+    
+    # Ключ сортировки сравнивается с сырым значением из БД
+    # (type_coerce не меняет SQL), поэтому курсор не зависит от формата дат
+    sort_column, descending = SORT_KEYS[sort_by]
+    sort_key = type_coerce(sort_column, NullType())
+    if descending:
+        query = query.order_by(desc(sort_column), desc(Book.id))
+    else:
+        query = query.order_by(asc(sort_column), asc(Book.id))
+    query = query.add_columns(sort_key.label("sort_key"))
+    
+    # Курсорный режим не считает total и не использует offset
+    if cursor:
+        total = None
+        position = decode_cursor(cursor, sort_by.value)
+        rows = fetch_after(query, sort_key, descending, position, Book.id, limit)
+    else:
+        total = count_books(db, filters)
+        rows = query.offset(offset).limit(limit + 1).all()
+    
+    books, next_cursor = page_rows(rows, limit, sort_by.value)
+    return books, total, next_cursor
+
+def parse_buckets(value: str, name: str) -> Tuple[float, ...]:
+    """Границы интервалов из строки вида "3600,10800": по возрастанию, без повторов"""
+    try:
+        bounds = tuple(sorted({float(part) for part in value.split(",") if part.strip()}))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}")
+    if len(bounds) > 20 or any(bound < 0 for bound in bounds):
+        raise HTTPException(status_code=400, detail=f"Invalid {name}")
+    return bounds
+
+def bucket_index(column, bounds: Tuple[float, ...]):
+    """Номер интервала [bounds[i-1], bounds[i]) для значения колонки, NULL остается NULL"""
+    if not bounds:
+        return case((column.is_(None), None), else_=0)
+    whens = [(column.is_(None), None)]
+    whens += [(column < bound, i) for i, bound in enumerate(bounds)]
+    return case(*whens, else_=len(bounds))
+
+def range_facets(counts: Dict[int, int], bounds: Tuple[float, ...]) -> List[RangeFacet]:
+    edges = (None,) + bounds + (None,)
+    return [
+        RangeFacet(min=edges[i], max=edges[i + 1], count=counts.get(i, 0))
+        for i in range(len(bounds) + 1)
+    ]
+
+def compute_facets(
+    db: Session,
+    filters: BookFilters,
+    duration_bounds: Tuple[float, ...],
+    rating_bounds: Tuple[float, ...]
+) -> FacetsResponse:
+    """Счетчики фасетов одним GROUP BY по активным книгам под фильтрами"""
+    duration_bucket = bucket_index(Book.duration_seconds, duration_bounds)
+    rating_bucket = bucket_index(Book.rating, rating_bounds)
+    query = db.query(
+        Book.category_id, Book.is_free, duration_bucket, rating_bucket, func.count(Book.id)
+    ).filter(Book.is_active == True)
+    query = apply_book_filters(query, filters).group_by(
+        Book.category_id, Book.is_free, duration_bucket, rating_bucket
+    )
+    
+    total = 0
+    by_category: Dict[int, int] = {}
+    by_free: Dict[bool, int] = {}
+    by_duration: Dict[int, int] = {}
+    by_rating: Dict[int, int] = {}
+    for category_id, is_free, duration_index, rating_index, count in query:
+        total += count
+        if category_id is not None:
+            by_category[category_id] = by_category.get(category_id, 0) + count
+        free = bool(is_free)
+        by_free[free] = by_free.get(free, 0) + count
+        # Книги без длительности или рейтинга не попадают ни в один интервал
+        if duration_index is not None:
+            by_duration[duration_index] = by_duration.get(duration_index, 0) + count
+        if rating_index is not None:
+            by_rating[rating_index] = by_rating.get(rating_index, 0) + count
+    
+    categories = db.query(Category.id, Category.name, Category.emoji).order_by(Category.name).all()
+    return FacetsResponse(
+        total=total,
+        categories=[
+            CategoryFacet(category_id=id, name=name, emoji=emoji, count=by_category.get(id, 0))
+            for id, name, emoji in categories
+        ],
+        is_free=[FreeFacet(is_free=free, count=by_free.get(free, 0)) for free in (True, False)],
+        durations=range_facets(by_duration, duration_bounds),
+        ratings=range_facets(by_rating, rating_bounds)
+    )
+
+@router.get("", response_model=BooksListResponse)
+async def get_books(
+    request: Request,
+    filters: BookFilters = Depends(get_book_filters),
     sort_by: SortBy = Query(SortBy.newest, description="Сортировка"),
-    limit: int = Query(20, le=100, description="Количество книг"),
+    limit: int = Query(20, ge=1, le=100, description="Количество книг"),
     offset: int = Query(0, ge=0, description="Смещение"),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы (next_cursor из предыдущего ответа)"),
     db: Session = Depends(get_db),
     current_user: Optional[User] = Depends(get_optional_user)
 ):
     """Получение списка книг с расширенными фильтрами"""
     
-    query = db.query(Book).filter(Book.is_active == True)
+    # Анонимный ответ одинаков для всех, поэтому отдается из кэша
+    cache_key = anonymous_cache_key(request, db) if current_user is None else None
+    if cache_key is not None:
+        cached = get_cached_response(request, cache_key)
+        if cached is not None:
+            return cached
     
-    # Применяем фильтры
-    if category_id:
-        query = query.filter(Book.category_id == category_id)
+    books, total, next_cursor = fetch_catalog_page(db, filters, sort_by, limit, offset, cursor)
     
-    if is_free is not None:
-        query = query.filter(Book.is_free == is_free)
-    
-    if min_rating is not None:
-        query = query.filter(Book.rating >= min_rating)
+    # Книги из кэша сериализованных фрагментов плюс прогресс пользователя
+    progress = get_users_progress(books, current_user, db)
+    body = dumps({
+        "books": books_json(books, progress, catalog_version.get(db)),
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "next_cursor": next_cursor
+    })
+    if cache_key is not None:
+        return cache_response(request, cache_key, body)
+    return JSONBytesResponse(body)
+
+@router.get("/search", response_model=SearchResponse)
+async def search_books(
+    request: Request,
+    q: str = Query(..., min_length=2, description="Поисковый запрос"),
+    limit: int = Query(20, ge=1, le=100, description="Количество результатов"),
+    db: Session = Depends(get_db),
+    current_user: Optional[User] = Depends(get_optional_user)
+):
+    """Поиск книг по названию, автору и описанию (полнотекстовый индекс, ранжирование bm25)"""
     
-    if min_duration is not None:
-        query = query.filter(Book.duration_seconds >= min_duration)
+    cache_key = anonymous_cache_key(request, db) if current_user is None else None
+    if cache_key is not None:
+        cached = get_cached_response(request, cache_key)
+        if cached is not None:
+            return cached
     
-    if max_duration is not None:
-        query = query.filter(Book.duration_seconds <= max_duration)
+    book_ids = search_book_ids(db, q, limit)
     
-    if author:
-        query = query.filter(Book.author.ilike(f"%{author}%"))
+    books_by_id = {
+        book.id: book
+        for book in db.query(Book).options(joinedload(Book.category)).filter(
+            Book.id.in_(book_ids)
+        )
+    } if book_ids else {}
+    books = [books_by_id[book_id] for book_id in book_ids if book_id in books_by_id]
     
-    # Применяем сортировку
-    if sort_by == SortBy.newest:
-        query = query.order_by(desc(Book.created_at))
-    elif sort_by == SortBy.oldest:
-        query = query.order_by(asc(Book.created_at))
-    elif sort_by == SortBy.popular:
-        query = query.order_by(desc(Book.plays_count))
-    elif sort_by == SortBy.rating:
-        query = query.order_by(desc(Book.rating))
-    elif sort_by == SortBy.alphabetical:
-        query = query.order_by(asc(Book.title))
-    elif sort_by == SortBy.duration_short:
-        query = query.order_by(asc(Book.duration_seconds))
-    elif sort_by == SortBy.duration_long:
-        query = query.order_by(desc(Book.duration_seconds))
+    # Книги из кэша сериализованных фрагментов плюс прогресс пользователя
+    progress = get_users_progress(books, current_user, db)
+    body = dumps({
+        "books": books_json(books, progress, catalog_version.get(db)),
+        "query": q,
+        "total": len(books)
+    })
+    if cache_key is not None:
+        return cache_response(request, cache_key, body)
+    return JSONBytesResponse(body)
+
+@router.get("/facets", response_model=FacetsResponse)
+async def get_facets(
+    request: Request,
+    filters: BookFilters = Depends(get_book_filters),
+    duration_buckets: str = Query(settings.facet_duration_buckets, description="Границы интервалов длительности в секундах через запятую"),
+    rating_buckets: str = Query(settings.facet_rating_buckets, description="Границы интервалов рейтинга через запятую"),
+    db: Session = Depends(get_db)
+):
+    """Количество книг по категориям, is_free и интервалам длительности и рейтинга"""
     
-    total = query.count()
-    books = query.offset(offset).limit(limit).all()
+    # Фасеты не зависят от пользователя: ответ общий и привязан к поколению каталога
+    cache_key = anonymous_cache_key(request, db)
+    cached = get_cached_response(request, cache_key)
+    if cached is not None:
+        return cached
     
-    # Обогащение данных о прогрессе пользователя
-    books_response = []
-    for book in books:
-        book_dict = BookResponse.model_validate(book).model_dump()
-        book_dict["user_progress"] = get_user_progress(book, current_user, db)
-        books_response.append(BookResponse(**book_dict))
-    
-    return BooksListResponse(
-        books=books_response,
-        total=total,
-        limit=limit,
-        offset=offset
+    facets = compute_facets(
+        db,
+        filters,
+        parse_buckets(duration_buckets, "duration_buckets"),
+        parse_buckets(rating_buckets, "rating_buckets")
     )
+    return cache_response(request, cache_key, dumps(facets.model_dump()))
+
+@router.get("/suggest", response_model=SuggestResponse)
+async def suggest_books(
+    q: str = Query(..., min_length=1, max_length=100, description="Набираемый запрос"),
+    limit: int = Query(8, ge=1, le=20, description="Количество подсказок"),
+    db: Session = Depends(get_db)
+):
+    """Подсказки по названиям и авторам из индекса в памяти (без запросов к БД)"""
+    
+    if suggest_index.needs_reload():
+        suggest_index.load(db)
+    
+    suggestions = [
+        SuggestItem(kind=kind, text=text, book_id=book_id)
+        for kind, text, book_id in suggest_index.suggest(q, limit)
+    ]
+    
+    return SuggestResponse(suggestions=suggestions, query=q)
 
 @router.get("/{book_id}", response_model=BookResponse)
 async def get_book(
     book_id: int,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: Optional[User] = Depends(get_optional_user)
 ):
     """Получение детальной информации о книге"""
     
-    book = db.query(Book).filter(
+    cache_key = anonymous_cache_key(request, db) if current_user is None else None
+    if cache_key is not None:
+        cached = get_cached_response(request, cache_key)
+        if cached is not None:
+            return cached
+    
+    book = db.query(Book).options(joinedload(Book.category)).filter(
         Book.id == book_id,
         Book.is_active == True
     ).first()
@@ -131,40 +407,8 @@ async def get_book(
         raise HTTPException(status_code=404, detail="Book not found")
     
     # Обогащение данных о прогрессе пользователя
-    book_dict = BookResponse.model_validate(book).model_dump()
-    book_dict["user_progress"] = get_user_progress(book, current_user, db)
-    
-    return BookResponse(**book_dict)
-
-@router.get("/search", response_model=SearchResponse)
-async def search_books(
-    q: str = Query(..., min_length=2, description="Поисковый запрос"),
-    limit: int = Query(20, le=100, description="Количество результатов"),
-    db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_optional_user)
-):
-    """Поиск книг по названию и автору"""
-    
-    search_term = f"%{q}%"
-    
-    books = db.query(Book).filter(
-        Book.is_active == True,
-        or_(
-            Book.title.ilike(search_term),
-            Book.author.ilike(search_term),
-            Book.description.ilike(search_term)
-        )
-    ).limit(limit).all()
-    
-    # Обогащение данных о прогрессе пользователя
-    books_response = []
-    for book in books:
-        book_dict = BookResponse.model_validate(book).model_dump()
-        book_dict["user_progress"] = get_user_progress(book, current_user, db)
-        books_response.append(BookResponse(**book_dict))
-    
-    return SearchResponse(
-        books=books_response,
-        query=q,
-        total=len(books_response)
-    ) 
\ No newline at end of file
+    progress = get_user_progress(book, current_user, db)
+    body = dumps(book_json(book, progress, catalog_version.get(db)))
+    if cache_key is not None:
+        return cache_response(request, cache_key, body)
+    return JSONBytesResponse(body)
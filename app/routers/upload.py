@@ -14,6 +14,8 @@ from ..models import Book, Admin
 from ..dependencies import get_current_admin
 from ..config import settings
 from ..utils import ensure_directory_exists
+from ..suggest import suggest_index
+from ..cache import catalog_version
 
 router = APIRouter(prefix="/api/admin/upload", tags=["upload"])
 
@@ -213,8 +215,10 @@ async def create_book_with_files(
     )
     
     db.add(book)
+    catalog_version.bump(db)
     db.commit()
     db.refresh(book)
+    suggest_index.update_book(book)
     
     return BookResponse.model_validate(book)
 
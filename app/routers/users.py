@@ -1,21 +1,41 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
-from datetime import datetime
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session, contains_eager, joinedload
+from sqlalchemy import and_, func, desc, literal, select, type_coerce
+from sqlalchemy.types import NullType
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional
 
-from ..database import get_db
+from ..database import get_db, upsert
 from ..schemas import (
     UserLibrary, HistoryUpdate, StatusResponse, FavoriteResponse,
     HistoryResponse, BookResponse, UserStats, RatingCreate, RatingUpdate,
+    LibraryHistoryPage, LibraryFavoritesPage, HistorySyncRequest, HistorySyncResponse,
     RatingResponse, BookRating, BookmarkCreate, BookmarkUpdate, BookmarkResponse
 )
-from ..models import User, Book, ListeningHistory, Favorite, Rating, Bookmark
+from ..models import User, Book, ListeningHistory, Favorite, Rating, Bookmark, LibraryTombstone, BookRatingStats, UserLibraryStats
 from ..dependencies import get_current_user, get_optional_user
+from ..cache import is_active_book
+from ..pagination import decode_cursor, fetch_after, page_rows
+from ..progress_buffer import PendingProgress, merge_progress, progress_buffer
 from ..utils import calculate_progress_percent
 
 router = APIRouter(prefix="/api/user", tags=["user"])
 
+def history_response(history: ListeningHistory) -> HistoryResponse:
+    """Запись истории с процентом прогресса"""
+    book = history.book
+    progress_percent = calculate_progress_percent(
+        history.current_position, 
+        history.total_duration or book.duration_seconds or 0
+    )
+    return HistoryResponse(
+        book=BookResponse.model_validate(book),
+        current_position=history.current_position,
+        progress_percent=progress_percent,
+        last_played=history.last_played,
+        is_finished=history.is_finished
+    )
+
 @router.get("/library", response_model=UserLibrary)
 async def get_user_library(
     db: Session = Depends(get_db),
@@ -23,30 +43,25 @@ async def get_user_library(
 ):
     """Получение библиотеки пользователя"""
     
+    progress_buffer.flush_user(db, current_user.id)
+    
     # История прослушивания
-    history_query = db.query(ListeningHistory).filter(
+    history_query = db.query(ListeningHistory).options(
+        joinedload(ListeningHistory.book).joinedload(Book.category)
+    ).filter(
         ListeningHistory.user_id == current_user.id
     ).order_by(desc(ListeningHistory.last_played))
     
-    history_items = []
-    for history in history_query.all():
-        book = history.book
-        if book and book.is_active:
-            progress_percent = calculate_progress_percent(
-                history.current_position, 
-                history.total_duration or book.duration_seconds or 0
-            )
-            
-            history_items.append(HistoryResponse(
-                book=BookResponse.model_validate(book),
-                current_position=history.current_position,
-                progress_percent=progress_percent,
-                last_played=history.last_played,
-                is_finished=history.is_finished
-            ))
+    history_items = [
+        history_response(history)
+        for history in history_query.all()
+        if history.book and history.book.is_active
+    ]
     
     # Избранные книги
-    favorites_query = db.query(Favorite).filter(
+    favorites_query = db.query(Favorite).options(
+        joinedload(Favorite.book).joinedload(Book.category)
+    ).filter(
         Favorite.user_id == current_user.id
     ).order_by(desc(Favorite.added_at))
     
@@ -56,23 +71,15 @@ async def get_user_library(
         if book and book.is_active:
             favorite_books.append(BookResponse.model_validate(book))
     
-    # Статистика
-    total_books = history_query.count()
-    finished_books = history_query.filter(ListeningHistory.is_finished == True).count()
-    
-    # Общее время прослушивания (приблизительно)
-    total_time_result = db.query(
-        func.sum(ListeningHistory.current_position)
-    ).filter(ListeningHistory.user_id == current_user.id).scalar()
-    
-    total_time_seconds = total_time_result or 0
-    favorite_count = len(favorite_books)
+    # Статистика истории поддерживается триггерами (app/migrations.py): чтение по ключу;
+    # избранное считается по возвращаемому списку, без скрытых книг
+    library_stats = db.get(UserLibraryStats, current_user.id)
     
     stats = UserStats(
-        total_books=total_books,
-        finished_books=finished_books,
-        total_time_seconds=total_time_seconds,
-        favorite_count=favorite_count
+        total_books=library_stats.total_books if library_stats else 0,
+        finished_books=library_stats.finished_books if library_stats else 0,
+        total_time_seconds=library_stats.listened_seconds if library_stats else 0,
+        favorite_count=len(favorite_books)
     )
     
     return UserLibrary(
@@ -81,6 +88,164 @@ async def get_user_library(
         stats=stats
     )
 
+class LibraryPage(NamedTuple):
+    rows: list
+    removed: List[int]
+    next_cursor: Optional[str]
+    library_version: int
+    has_more: bool
+
+def fetch_library_page(
+    db: Session,
+    user_id: int,
+    model,
+    kind: str,
+    sort_column,
+    limit: int,
+    cursor: Optional[str],
+    since: Optional[int]
+) -> LibraryPage:
+    """Страница истории или избранного: по курсору (новые сверху) или изменения после версии since"""
+    # Версия читается до записей: изменения, попавшие между запросами, придут повторно
+    library_version = db.query(User.library_version).filter(User.id == user_id).scalar() or 0
+    
+    if since is not None:
+        rows = db.query(model).options(
+            joinedload(model.book).joinedload(Book.category)
+        ).filter(
+            model.user_id == user_id,
+            model.version > since
+        ).order_by(model.version).limit(limit + 1).all()
+        tombstones = db.query(LibraryTombstone.version, LibraryTombstone.book_id).filter(
+            LibraryTombstone.user_id == user_id,
+            LibraryTombstone.kind == kind,
+            LibraryTombstone.version > since
+        ).order_by(LibraryTombstone.version).limit(limit + 1).all()
+        
+        # Изменения и удаления в порядке версий; при обрезке клиент продолжит с последней
+        changes = sorted(
+            [(row.version, row, None) for row in rows] +
+            [(version, None, book_id) for version, book_id in tombstones],
+            key=lambda change: change[0]
+        )
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+        if has_more:
+            library_version = changes[-1][0]
+        
+        # Запись о скрытой книге для клиента равносильна удалению
+        active_rows = [row for _, row, _ in changes if row is not None and row.book and row.book.is_active]
+        removed = [
+            book_id if row is None else row.book_id
+            for _, row, book_id in changes
+            if row is None or not (row.book and row.book.is_active)
+        ]
+        return LibraryPage(active_rows, removed, None, library_version, has_more)
+    
+    sort_key = type_coerce(sort_column, NullType())
+    query = db.query(model).join(model.book).options(
+        contains_eager(model.book).joinedload(Book.category)
+    ).filter(
+        model.user_id == user_id,
+        Book.is_active == True
+    ).order_by(desc(sort_column), desc(model.id)).add_columns(sort_key.label("sort_key"))
+    
+    if cursor:
+        rows = fetch_after(query, sort_key, True, decode_cursor(cursor), model.id, limit)
+    else:
+        rows = query.limit(limit + 1).all()
+    
+    items, next_cursor = page_rows(rows, limit)
+    return LibraryPage(items, [], next_cursor, library_version, False)
+
+@router.get("/library/history", response_model=LibraryHistoryPage)
+async def get_library_history(
+    limit: int = Query(50, ge=1, le=200, description="Количество записей"),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы (next_cursor из предыдущего ответа)"),
+    since: Optional[int] = Query(None, ge=0, description="Только изменения после этой library_version"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """История прослушивания постранично или изменения с последней синхронизации"""
+    
+    progress_buffer.flush_user(db, current_user.id)
+    
+    page = fetch_library_page(
+        db, current_user.id, ListeningHistory, "history", ListeningHistory.last_played,
+        limit, cursor, since
+    )
+    
+    return LibraryHistoryPage(
+        items=[history_response(history) for history in page.rows],
+        removed=page.removed,
+        next_cursor=page.next_cursor,
+        library_version=page.library_version,
+        has_more=page.has_more
+    )
+
+@router.get("/library/favorites", response_model=LibraryFavoritesPage)
+async def get_library_favorites(
+    limit: int = Query(50, ge=1, le=200, description="Количество записей"),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы (next_cursor из предыдущего ответа)"),
+    since: Optional[int] = Query(None, ge=0, description="Только изменения после этой library_version"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Избранное постранично или изменения с последней синхронизации"""
+    
+    page = fetch_library_page(
+        db, current_user.id, Favorite, "favorite", Favorite.added_at,
+        limit, cursor, since
+    )
+    
+    return LibraryFavoritesPage(
+        items=[BookResponse.model_validate(favorite.book) for favorite in page.rows],
+        removed=page.removed,
+        next_cursor=page.next_cursor,
+        library_version=page.library_version,
+        has_more=page.has_more
+    )
+
+@router.post("/history/sync", response_model=HistorySyncResponse)
+async def sync_listening_progress(
+    sync: HistorySyncRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Пакетная синхронизация прогресса, накопленного клиентом без сети.
+    
+    По каждой книге побеждает событие с самым поздним client_timestamp; все книги
+    записываются одной транзакцией вместе с буфером прогресса пользователя."""
+    
+    book_ids = {event.book_id for event in sync.events}
+    active_ids = {
+        book_id
+        for (book_id,) in db.query(Book.id).filter(Book.id.in_(book_ids), Book.is_active == True)
+    } if book_ids else set()
+    
+    # Время клиента приводится к UTC и не может быть позже серверного
+    now = datetime.utcnow()
+    entries: Dict[int, PendingProgress] = {}
+    for event in sync.events:
+        if event.book_id not in active_ids:
+            continue
+        played = event.client_timestamp
+        if played.tzinfo is not None:
+            played = played.astimezone(timezone.utc).replace(tzinfo=None)
+        played = min(played, now)
+        item = PendingProgress(event.position, event.duration, played, played, 0)
+        current = entries.get(event.book_id)
+        entries[event.book_id] = item if current is None else merge_progress(current, item)
+    
+    if entries:
+        progress_buffer.write(db, current_user.id, entries)
+    
+    return HistorySyncResponse(
+        status="success",
+        applied=len(entries),
+        ignored_book_ids=sorted(book_ids - active_ids)
+    )
+
 @router.post("/history/{book_id}", response_model=StatusResponse)
 async def update_listening_progress(
     book_id: int,
@@ -91,46 +256,13 @@ async def update_listening_progress(
     """Обновление прогресса прослушивания"""
     
     # Проверка существования книги
-    book = db.query(Book).filter(
-        Book.id == book_id,
-        Book.is_active == True
-    ).first()
-    
-    if not book:
+    if not is_active_book(db, book_id):
         raise HTTPException(status_code=404, detail="Book not found")
     
-    # Поиск или создание записи истории
-    history = db.query(ListeningHistory).filter(
-        ListeningHistory.user_id == current_user.id,
-        ListeningHistory.book_id == book_id
-    ).first()
-    
-    if not history:
-        history = ListeningHistory(
-            user_id=current_user.id,
-            book_id=book_id,
-            current_position=progress.position,
-            total_duration=progress.duration,
-            last_played=datetime.utcnow()
-        )
-        db.add(history)
-    else:
-        history.current_position = progress.position
-        history.total_duration = progress.duration
-        history.last_played = datetime.utcnow()
-        history.play_count += 1
-    
-    # Определение завершенности
-    if progress.duration > 0:
-        progress_percent = (progress.position / progress.duration) * 100
-        history.is_finished = progress_percent >= 95  # 95% считается завершенным
-    
-    # Обновление счетчика прослушиваний книги
-    book.plays_count = db.query(ListeningHistory).filter(
-        ListeningHistory.book_id == book_id
-    ).count()
-    
-    db.commit()
+    # Прогресс записывается в БД пачкой из буфера (app/progress_buffer.py)
+    progress_buffer.add(current_user.id, book_id, progress.position, progress.duration)
+    if progress_buffer.is_full():
+        progress_buffer.flush(db)
     
     progress_percent = calculate_progress_percent(progress.position, progress.duration)
     
@@ -148,32 +280,20 @@ async def add_to_favorites(
     """Добавление книги в избранное"""
     
     # Проверка существования книги
-    book = db.query(Book).filter(
-        Book.id == book_id,
-        Book.is_active == True
-    ).first()
-    
-    if not book:
+    if not is_active_book(db, book_id):
         raise HTTPException(status_code=404, detail="Book not found")
     
-    # Проверка, не в избранном ли уже
-    existing = db.query(Favorite).filter(
-        Favorite.user_id == current_user.id,
-        Favorite.book_id == book_id
-    ).first()
-    
-    if existing:
-        return FavoriteResponse(status="already_added", book_id=book_id)
-    
-    # Добавление в избранное
-    favorite = Favorite(
+    # Одним оператором: при повторном добавлении строка не вставляется и не возвращается
+    stmt = upsert(db, Favorite).values(
         user_id=current_user.id,
         book_id=book_id
-    )
-    db.add(favorite)
+    ).on_conflict_do_nothing(
+        index_elements=[Favorite.user_id, Favorite.book_id]
+    ).returning(Favorite.id)
+    added = db.execute(stmt).first() is not None
     db.commit()
     
-    return FavoriteResponse(status="added", book_id=book_id)
+    return FavoriteResponse(status="added" if added else "already_added", book_id=book_id)
 
 @router.delete("/favorites/{book_id}", response_model=FavoriteResponse)
 async def remove_from_favorites(
@@ -196,63 +316,6 @@ async def remove_from_favorites(
     
     return FavoriteResponse(status="removed", book_id=book_id)
 
-@router.post("/history/{book_id}", response_model=StatusResponse)
-async def update_listening_progress(
-    book_id: int,
-    progress: HistoryUpdate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
-    """Обновление прогресса прослушивания"""
-    
-    # Проверяем существование книги
-    book = db.query(Book).filter(
-        Book.id == book_id,
-        Book.is_active == True
-    ).first()
-    
-    if not book:
-        raise HTTPException(status_code=404, detail="Book not found")
-    
-    # Ищем существующую запись в истории
-    history = db.query(ListeningHistory).filter(
-        ListeningHistory.user_id == current_user.id,
-        ListeningHistory.book_id == book_id
-    ).first()
-    
-    if history:
-        # Обновляем существующую запись
-        history.current_position = progress.position
-        history.total_duration = progress.duration
-        history.last_played = datetime.utcnow()
-        history.play_count += 1
-        
-        # Определяем, закончена ли книга (если прослушано более 95%)
-        if progress.duration > 0:
-            progress_percent = (progress.position / progress.duration) * 100
-            history.is_finished = progress_percent >= 95.0
-    else:
-        # Создаем новую запись
-        history = ListeningHistory(
-            user_id=current_user.id,
-            book_id=book_id,
-            current_position=progress.position,
-            total_duration=progress.duration,
-            is_finished=False,
-            play_count=1
-        )
-        db.add(history)
-    
-    # Обновляем счетчик воспроизведений книги
-    book.plays_count += 1
-    
-    db.commit()
-    
-    return StatusResponse(
-        status="success", 
-        message=f"Progress updated: {progress.position}s / {progress.duration}s"
-    )
-
 @router.get("/history/{book_id}", response_model=dict)
 async def get_listening_progress(
     book_id: int,
@@ -261,6 +324,8 @@ async def get_listening_progress(
 ):
     """Получение прогресса прослушивания конкретной книги"""
     
+    progress_buffer.flush_user(db, current_user.id)
+    
     # Проверяем существование книги
     book = db.query(Book).filter(
         Book.id == book_id,
@@ -308,35 +373,33 @@ async def mark_book_finished(
 ):
     """Отметить книгу как прослушанную"""
     
-    # Проверяем существование книги
-    book = db.query(Book).filter(
-        Book.id == book_id,
-        Book.is_active == True
-    ).first()
+    # Незаписанный прогресс старше отметки о завершении
+    progress_buffer.discard(current_user.id, book_id)
+    
+    # Вставка из активной книги или отметка существующей записи одним оператором;
+    # пустой RETURNING означает, что книги нет
+    now = datetime.utcnow()
+    stmt = upsert(db, ListeningHistory).from_select(
+        ["user_id", "book_id", "current_position", "total_duration", "last_played", "is_finished", "play_count"],
+        select(
+            literal(current_user.id),
+            Book.id,
+            func.coalesce(Book.duration_seconds, 0),
+            Book.duration_seconds,
+            literal(now),
+            literal(True),
+            literal(1)
+        ).where(Book.id == book_id, Book.is_active == True)
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ListeningHistory.user_id, ListeningHistory.book_id],
+        set_={"is_finished": True, "last_played": now}
+    ).returning(ListeningHistory.id)
     
-    if not book:
+    if db.execute(stmt).first() is None:
+        db.rollback()
         raise HTTPException(status_code=404, detail="Book not found")
     
-    # Ищем или создаем запись в истории
-    history = db.query(ListeningHistory).filter(
-        ListeningHistory.user_id == current_user.id,
-        ListeningHistory.book_id == book_id
-    ).first()
-    
-    if history:
-        history.is_finished = True
-        history.last_played = datetime.utcnow()
-    else:
-        history = ListeningHistory(
-            user_id=current_user.id,
-            book_id=book_id,
-            current_position=book.duration_seconds or 0,
-            total_duration=book.duration_seconds,
-            is_finished=True,
-            play_count=1
-        )
-        db.add(history)
-    
     db.commit()
     
     return StatusResponse(status="success", message="Book marked as finished")
@@ -350,49 +413,30 @@ async def rate_book(
 ):
     """Оценить книгу"""
     
-    # Проверяем существование книги
-    book = db.query(Book).filter(
-        Book.id == book_id,
-        Book.is_active == True
-    ).first()
-    
-    if not book:
+    # Проверка существования книги
+    if not is_active_book(db, book_id):
         raise HTTPException(status_code=404, detail="Book not found")
     
-    # Ищем существующий рейтинг
-    existing_rating = db.query(Rating).filter(
-        Rating.user_id == current_user.id,
-        Rating.book_id == book_id
-    ).first()
+    # Вставка или обновление одним оператором; агрегаты книги обновляются
+    # триггерами в той же транзакции (app/migrations.py)
+    stmt = upsert(db, Rating).values(
+        user_id=current_user.id,
+        book_id=book_id,
+        rating=rating_data.rating,
+        comment=rating_data.comment
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Rating.user_id, Rating.book_id],
+        set_={
+            "rating": stmt.excluded.rating,
+            "comment": stmt.excluded.comment,
+            "updated_at": datetime.utcnow()
+        }
+    ).returning(*Rating.__table__.columns)
+    rating = db.execute(stmt).one()
+    db.commit()
     
-    if existing_rating:
-        # Обновляем существующий рейтинг
-        existing_rating.rating = rating_data.rating
-        existing_rating.comment = rating_data.comment
-        existing_rating.updated_at = datetime.utcnow()
-        db.commit()
-        db.refresh(existing_rating)
-        
-        # Обновляем средний рейтинг книги
-        update_book_rating(book, db)
-        
-        return RatingResponse.model_validate(existing_rating)
-    else:
-        # Создаем новый рейтинг
-        new_rating = Rating(
-            user_id=current_user.id,
-            book_id=book_id,
-            rating=rating_data.rating,
-            comment=rating_data.comment
-        )
-        db.add(new_rating)
-        db.commit()
-        db.refresh(new_rating)
-        
-        # Обновляем средний рейтинг книги
-        update_book_rating(book, db)
-        
-        return RatingResponse.model_validate(new_rating)
+    return RatingResponse.model_validate(rating)
 
 @router.get("/ratings/{book_id}", response_model=BookRating)
 async def get_book_rating(
@@ -402,37 +446,29 @@ async def get_book_rating(
 ):
     """Получение рейтинга книги"""
     
-    # Проверяем существование книги
-    book = db.query(Book).filter(
+    # Книга, ее агрегаты оценок и оценка текущего пользователя одним запросом
+    row = db.query(Book.id, BookRatingStats, Rating.rating).outerjoin(
+        BookRatingStats, BookRatingStats.book_id == Book.id
+    ).outerjoin(
+        Rating, and_(Rating.book_id == Book.id, Rating.user_id == (current_user.id if current_user else None))
+    ).filter(
         Book.id == book_id,
         Book.is_active == True
     ).first()
     
-    if not book:
+    if not row:
         raise HTTPException(status_code=404, detail="Book not found")
     
-    # Вычисляем средний рейтинг
-    rating_stats = db.query(
-        func.avg(Rating.rating).label('average'),
-        func.count(Rating.id).label('total')
-    ).filter(Rating.book_id == book_id).first()
-    
-    average_rating = float(rating_stats.average) if rating_stats.average else 0.0
-    total_ratings = rating_stats.total or 0
-    
-    # Получаем рейтинг текущего пользователя
-    user_rating = None
-    if current_user:
-        user_rating_obj = db.query(Rating).filter(
-            Rating.user_id == current_user.id,
-            Rating.book_id == book_id
-        ).first()
-        user_rating = user_rating_obj.rating if user_rating_obj else None
+    stats = row.BookRatingStats
+    total_ratings = stats.rating_count if stats else 0
+    average_rating = stats.rating_sum / total_ratings if total_ratings else 0.0
+    user_rating = row.rating
     
     return BookRating(
         average_rating=round(average_rating, 1),
         total_ratings=total_ratings,
-        user_rating=user_rating
+        user_rating=user_rating,
+        histogram=stats.histogram if stats else [0] * 5
     )
 
 @router.delete("/ratings/{book_id}", response_model=StatusResponse)
@@ -452,25 +488,10 @@ async def delete_rating(
         raise HTTPException(status_code=404, detail="Rating not found")
     
     db.delete(rating)
-    
-    # Обновляем средний рейтинг книги
-    book = db.query(Book).filter(Book.id == book_id).first()
-    if book:
-        update_book_rating(book, db)
-    
     db.commit()
     
     return StatusResponse(status="success", message="Rating deleted")
 
-def update_book_rating(book: Book, db: Session):
-    """Обновление среднего рейтинга книги"""
-    rating_stats = db.query(
-        func.avg(Rating.rating).label('average')
-    ).filter(Rating.book_id == book.id).first()
-    
-    book.rating = float(rating_stats.average) if rating_stats.average else 0.0
-    db.commit()
-
 @router.post("/bookmarks/{book_id}", response_model=BookmarkResponse)
 async def create_bookmark(
     book_id: int,
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from typing import Optional, List
-from datetime import datetime
+from datetime import date, datetime
 
 # Telegram Auth Schemas
 class TelegramAuth(BaseModel):
@@ -86,15 +86,30 @@ class BookResponse(BookBase):
 
 class BooksListResponse(BaseModel):
     books: List[BookResponse]
-    total: int
+    total: Optional[int] = None  # Не считается в курсорном режиме
     limit: int
     offset: int
+    next_cursor: Optional[str] = None
 
 # History Schemas
 class HistoryUpdate(BaseModel):
     position: int
     duration: int
 
+class HistorySyncEvent(BaseModel):
+    book_id: int
+    position: int = Field(..., ge=0)
+    duration: int = Field(..., ge=0)
+    client_timestamp: datetime  # Когда событие произошло на устройстве
+
+class HistorySyncRequest(BaseModel):
+    events: List[HistorySyncEvent] = Field(..., max_length=1000)
+
+class HistorySyncResponse(BaseModel):
+    status: str
+    applied: int  # Сколько книг обновлено
+    ignored_book_ids: List[int] = []  # Несуществующие или скрытые книги
+
 class HistoryResponse(BaseModel):
     book: BookResponse
     current_position: int
@@ -145,24 +160,87 @@ class UserLibrary(BaseModel):
     favorites: List[BookResponse]
     stats: UserStats
 
+class LibraryHistoryPage(BaseModel):
+    items: List[HistoryResponse]
+    removed: List[int] = []  # book_id удаленных записей (только в режиме since)
+    next_cursor: Optional[str] = None
+    library_version: int  # Версия, до которой включительно клиент получил изменения
+    has_more: bool = False  # В режиме since: есть изменения после library_version
+
+class LibraryFavoritesPage(BaseModel):
+    items: List[BookResponse]
+    removed: List[int] = []
+    next_cursor: Optional[str] = None
+    library_version: int
+    has_more: bool = False
+
 # Search Schemas
 class SearchResponse(BaseModel):
     books: List[BookResponse]
     query: str
     total: int
 
+class SuggestItem(BaseModel):
+    kind: str  # "title" или "author"
+    text: str
+    book_id: Optional[int] = None
+
+class SuggestResponse(BaseModel):
+    suggestions: List[SuggestItem]
+    query: str
+
+# Facets Schemas
+class CategoryFacet(BaseModel):
+    category_id: int
+    name: str
+    emoji: Optional[str] = None
+    count: int
+
+class FreeFacet(BaseModel):
+    is_free: bool
+    count: int
+
+class RangeFacet(BaseModel):
+    min: Optional[float] = None  # включительно
+    max: Optional[float] = None  # не включительно, None - без верхней границы
+    count: int
+
+class FacetsResponse(BaseModel):
+    total: int
+    categories: List[CategoryFacet]
+    is_free: List[FreeFacet]
+    durations: List[RangeFacet]
+    ratings: List[RangeFacet]
+
 # Dashboard Schemas
 class DashboardStats(BaseModel):
     total_users: int
     total_books: int
     total_plays: int
     new_users_today: int
+    listened_seconds_today: int
+    listeners_today: int
 
 class DashboardResponse(BaseModel):
     stats: DashboardStats
     recent_books: List[BookResponse]
     popular_books: List[BookResponse]
 
+class DailyListening(BaseModel):
+    day: date
+    listened_seconds: int
+    listeners: int
+
+class BookListening(BaseModel):
+    book_id: int
+    title: str
+    listened_seconds: int
+    listener_days: int  # Сумма уникальных слушателей по дням
+
+class ListeningAnalyticsResponse(BaseModel):
+    days: List[DailyListening]
+    top_books: List[BookListening]
+
 # Response Schemas
 class StatusResponse(BaseModel):
     status: str
@@ -198,6 +276,7 @@ class BookRating(BaseModel):
     average_rating: float
     total_ratings: int
     user_rating: Optional[int] = None
+    histogram: List[int] = []  # Количество оценок 1..5
 
 # Bookmark Schemas
 class BookmarkBase(BaseModel):
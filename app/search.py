@@ -0,0 +1,56 @@
+import re
+from typing import List, Optional
+
+from sqlalchemy import or_, text
+from sqlalchemy.orm import Session
+
+from .models import Book
+
+# Веса bm25 для колонок books_fts: title, author, description
+BM25_WEIGHTS = (10.0, 5.0, 1.0)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+def build_match_query(query: str) -> Optional[str]:
+    """Преобразование пользовательского запроса в выражение FTS5 MATCH.
+
+    Все слова должны присутствовать; последнее (набираемое) ищется как префикс.
+    Слова берутся в кавычки, поэтому операторы FTS5 во вводе не работают."""
+    tokens = _TOKEN_RE.findall(query)
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+def search_book_ids(db: Session, query: str, limit: int) -> List[int]:
+    """ID активных книг, подходящих под запрос, в порядке релевантности"""
+    if db.get_bind().dialect.name != "sqlite":
+        search_term = f"%{query}%"
+        rows = db.query(Book.id).filter(
+            Book.is_active == True,
+            or_(
+                Book.title.ilike(search_term),
+                Book.author.ilike(search_term),
+                Book.description.ilike(search_term)
+            )
+        ).limit(limit).all()
+        return [book_id for (book_id,) in rows]
+
+    match_query = build_match_query(query)
+    if not match_query:
+        return []
+
+    weights = ", ".join(str(weight) for weight in BM25_WEIGHTS)
+    rows = db.execute(
+        text(f"""
+            SELECT books.id
+            FROM books_fts
+            JOIN books ON books.id = books_fts.rowid
+            WHERE books_fts MATCH :match_query AND books.is_active = 1
+            ORDER BY bm25(books_fts, {weights})
+            LIMIT :limit
+        """),
+        {"match_query": match_query, "limit": limit}
+    ).all()
+    return [book_id for (book_id,) in rows]
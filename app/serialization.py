@@ -0,0 +1,44 @@
+from typing import Any, Dict, List, Optional
+
+import orjson
+from fastapi import Response
+
+from .cache import LRUCache
+from .config import settings
+from .models import Book
+from .schemas import BookResponse, UserProgress
+
+class JSONBytesResponse(Response):
+    """Ответ с заранее сериализованным JSON (без повторной валидации FastAPI)"""
+    media_type = "application/json"
+
+def dumps(payload: Any) -> bytes:
+    return orjson.dumps(payload)
+
+# JSON BookResponse без user_progress. В ключ входит все, что меняет вывод:
+# updated_at (правки админа), счетчики, обновляемые пользователями, и поколение
+# каталога (правки категорий, вложенных в книгу)
+book_json_cache = LRUCache(maxsize=settings.book_json_cache_size)
+
+def book_fragment(book: Book, generation: int) -> bytes:
+    """Сериализованная книга из кэша или через BookResponse при промахе"""
+    key = (book.id, book.updated_at, book.plays_count, book.rating, generation)
+    fragment = book_json_cache.get(key)
+    if fragment is None:
+        data = BookResponse.model_validate(book).model_dump(mode="json", exclude={"user_progress"})
+        fragment = orjson.dumps(data)
+        book_json_cache.set(key, fragment)
+    return fragment
+
+def book_json(book: Book, progress: Optional[UserProgress], generation: int) -> orjson.Fragment:
+    """Книга с наложенным прогрессом пользователя для вставки в ответ"""
+    progress_json = orjson.dumps(progress.model_dump()) if progress else b"null"
+    # Фрагмент - JSON-объект, поэтому поле дописывается перед закрывающей скобкой
+    return orjson.Fragment(book_fragment(book, generation)[:-1] + b',"user_progress":' + progress_json + b"}")
+
+def books_json(
+    books: List[Book],
+    progress: Dict[int, UserProgress],
+    generation: int
+) -> List[orjson.Fragment]:
+    return [book_json(book, progress.get(book.id), generation) for book in books]
@@ -0,0 +1,158 @@
+import math
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .models import Book
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Ключ подсказки: ("title", id книги) или ("author", нормализованное имя)
+SuggestKey = Tuple[str, object]
+
+def normalize(text: str) -> str:
+    """Нормализация для сравнения: регистр, ё -> е, только буквы и цифры"""
+    return " ".join(_WORD_RE.findall(text.casefold().replace("ё", "е")))
+
+def trigrams(text: str, partial_last_word: bool = False) -> Set[str]:
+    """Триграммы слов с дополнением пробелами, как в pg_trgm.
+
+    Для набираемого запроса последнее слово не дополняется справа,
+    чтобы «кни» совпадало с началом «книга»."""
+    words = text.split()
+    grams = set()
+    for i, word in enumerate(words):
+        is_partial = partial_last_word and i == len(words) - 1
+        padded = f"  {word}" if is_partial else f"  {word} "
+        grams.update(padded[j:j + 3] for j in range(len(padded) - 2))
+    return grams
+
+class SuggestIndex:
+    """Триграммный индекс названий и авторов активных книг в памяти процесса.
+
+    Админские эндпоинты обновляют его точечно; полная перезагрузка из БД
+    выполняется при первом обращении и раз в settings.suggest_index_ttl секунд,
+    чтобы подхватить изменения, сделанные другим воркером."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded_at: Optional[float] = None
+        self._texts: Dict[SuggestKey, str] = {}
+        self._normalized: Dict[SuggestKey, str] = {}
+        self._grams: Dict[SuggestKey, Set[str]] = {}
+        self._postings: Dict[str, Set[SuggestKey]] = {}
+        self._author_books: Dict[str, Set[int]] = {}
+        self._book_authors: Dict[int, str] = {}
+
+    def needs_reload(self) -> bool:
+        return (
+            self._loaded_at is None
+            or time.monotonic() - self._loaded_at > settings.suggest_index_ttl
+        )
+
+    def load(self, db: Session):
+        """Полная перестройка индекса по активным книгам"""
+        rows = db.query(Book.id, Book.title, Book.author).filter(Book.is_active == True).all()
+        with self._lock:
+            self._texts.clear()
+            self._normalized.clear()
+            self._grams.clear()
+            self._postings.clear()
+            self._author_books.clear()
+            self._book_authors.clear()
+            for book_id, title, author in rows:
+                self._add(book_id, title, author)
+            self._loaded_at = time.monotonic()
+
+    def update_book(self, book: Book):
+        """Точечное обновление после создания, изменения или переключения статуса книги"""
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            self._remove(book.id)
+            if book.is_active:
+                self._add(book.id, book.title, book.author)
+
+    def remove_book(self, book_id: int):
+        """Удаление книги из индекса"""
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            self._remove(book_id)
+
+    def suggest(self, query: str, limit: int) -> List[Tuple[str, str, Optional[int]]]:
+        """Подсказки (kind, text, book_id), устойчивые к опечаткам"""
+        normalized = normalize(query)
+        query_grams = trigrams(normalized, partial_last_word=True)
+        if not query_grams:
+            return []
+
+        with self._lock:
+            shared = Counter()
+            for gram in query_grams:
+                shared.update(self._postings.get(gram, ()))
+
+            min_shared = max(1, math.ceil(len(query_grams) * settings.suggest_min_similarity))
+            scored = []
+            for key, count in shared.items():
+                if count < min_shared:
+                    continue
+                text = self._texts[key]
+                normalized_text = self._normalized[key]
+                is_prefix = normalized_text.startswith(normalized) or f" {normalized}" in normalized_text
+                scored.append((not is_prefix, -count, len(text), text, key))
+
+        # Сначала совпадения по началу слова, затем по числу общих триграмм
+        scored.sort(key=lambda item: item[:4])
+        return [
+            (kind, text, value if kind == "title" else None)
+            for _, _, _, text, (kind, value) in scored[:limit]
+        ]
+
+    def _add(self, book_id: int, title: str, author: str):
+        self._index(("title", book_id), title)
+
+        author_key = normalize(author)
+        if author_key:
+            self._book_authors[book_id] = author_key
+            books = self._author_books.setdefault(author_key, set())
+            if not books:
+                self._index(("author", author_key), author)
+            books.add(book_id)
+
+    def _remove(self, book_id: int):
+        self._unindex(("title", book_id))
+
+        author_key = self._book_authors.pop(book_id, None)
+        if author_key is not None:
+            books = self._author_books.get(author_key, set())
+            books.discard(book_id)
+            if not books:
+                self._author_books.pop(author_key, None)
+                self._unindex(("author", author_key))
+
+    def _index(self, key: SuggestKey, text: str):
+        normalized_text = normalize(text)
+        grams = trigrams(normalized_text)
+        self._texts[key] = text
+        self._normalized[key] = normalized_text
+        self._grams[key] = grams
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(key)
+
+    def _unindex(self, key: SuggestKey):
+        self._texts.pop(key, None)
+        self._normalized.pop(key, None)
+        for gram in self._grams.pop(key, ()):
+            keys = self._postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[gram]
+
+suggest_index = SuggestIndex()
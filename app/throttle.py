@@ -0,0 +1,32 @@
+import math
+import threading
+import time
+from typing import Hashable, Optional
+
+from .cache import LRUCache
+
+class AttemptThrottle:
+    """Ограничение числа попыток на ключ в фиксированном окне.
+
+    Попытка учитывается до выполнения дорогой проверки, поэтому поток запросов
+    сверх лимита отклоняется без нагрузки на процессор. Счетчики живут в памяти
+    воркера: при нескольких воркерах лимит действует в каждом из них."""
+
+    def __init__(self, max_attempts: int, window: float, maxsize: int):
+        self.max_attempts = max_attempts
+        self.window = window
+        self._counters = LRUCache(maxsize=maxsize, ttl=window)
+        self._lock = threading.Lock()
+
+    def hit(self, key: Hashable) -> Optional[int]:
+        """Учет попытки; при превышении лимита - секунды до конца окна, иначе None"""
+        now = time.monotonic()
+        with self._lock:
+            count, window_end = self._counters.get(key, (0, now + self.window))
+            if count >= self.max_attempts:
+                return max(1, math.ceil(window_end - now))
+            self._counters.set(key, (count + 1, window_end), ttl=window_end - now)
+        return None
+
+    def reset(self, key: Hashable):
+        self._counters.pop(key)
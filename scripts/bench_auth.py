@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк накладных расходов авторизации на запрос
+
+Создает временную базу с пользователем и сравнивает время на запрос для
+разбора JWT и зависимости get_current_user без кэшей (как до появления
+кэшей токенов и пользователей) и с прогретыми кэшами. Затем измеряет
+пропускную способность POST /api/auth/telegram при всплеске входов
+(рассылка бота): сначала новые пользователи, затем повторный вход тех же
+пользователей, который не должен писать в БД.
+
+Использование: python scripts/bench_auth.py [--repeat 20000] [--logins 2000]
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+# Добавляем путь к приложению
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+def build_init_data(telegram_id: int, bot_token: str) -> str:
+    """initData Telegram Web App, подписанный токеном бота"""
+    from app.auth import webapp_secret
+
+    params = {
+        "auth_date": str(int(time.time())),
+        "user": json.dumps({"id": telegram_id, "first_name": f"User {telegram_id}", "username": f"user{telegram_id}"}),
+    }
+    data_check_string = "\n".join(f"{key}={value}" for key, value in sorted(params.items()))
+    params["hash"] = hmac.new(webapp_secret(bot_token), data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(params)
+
+def login_burst(client, init_data: list) -> float:
+    """Входы подряд; возвращает количество входов в секунду"""
+    started = time.perf_counter()
+    for data in init_data:
+        response = client.post("/api/auth/telegram", json={"initData": data})
+        assert response.status_code == 200, response.text
+    return len(init_data) / (time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк авторизации")
+    parser.add_argument("--repeat", type=int, default=20000, help="Повторов на замер")
+    parser.add_argument("--logins", type=int, default=2000, help="Входов во всплеске")
+    args = parser.parse_args()
+
+    # База создается до импорта приложения, чтобы движок указывал на нее
+    temp_dir = tempfile.mkdtemp(prefix="audioflow-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(temp_dir, 'bench.db')}"
+
+    from fastapi.security import HTTPAuthorizationCredentials
+    from jose import jwt
+    from app.auth import create_access_token, decode_token, get_current_user, token_cache, user_cache
+    from app.config import settings
+    from app.database import engine, SessionLocal
+    from app.models import Base, User
+
+    print("🎧 Бенчмарк авторизации AudioFlow")
+    print("=" * 60)
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user = User(telegram_id=1, username="bench")
+    db.add(user)
+    db.commit()
+    token = create_access_token({"sub": str(user.id)})
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+    def clear_caches():
+        token_cache.clear()
+        user_cache.clear()
+
+    def timed(fn, cold: bool) -> float:
+        """Среднее время вызова в микросекундах"""
+        fn()
+        total = 0.0
+        for _ in range(args.repeat):
+            if cold:
+                clear_caches()
+            started = time.perf_counter()
+            fn()
+            total += time.perf_counter() - started
+        return total / args.repeat * 1_000_000
+
+    loop = asyncio.new_event_loop()
+
+    def resolve_user():
+        loop.run_until_complete(get_current_user(credentials=credentials, db=db))
+        db.expunge_all()
+
+    results = [
+        ("jwt.decode", timed(lambda: jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm]), cold=True)),
+        ("decode_token (кэш)", timed(lambda: decode_token(token), cold=False)),
+        ("get_current_user без кэшей", timed(resolve_user, cold=True)),
+        ("get_current_user с кэшами", timed(resolve_user, cold=False)),
+    ]
+
+    print(f"{'операция':<32}{'мкс/запрос':>14}")
+    print("-" * 60)
+    for name, micros in results:
+        print(f"{name:<32}{micros:>14.1f}")
+
+    print("=" * 60)
+    print(f"Разбор токена: ускорение в {results[0][1] / results[1][1]:.0f} раз")
+    print(f"Зависимость авторизации: ускорение в {results[2][1] / results[3][1]:.1f} раз")
+
+    loop.close()
+    db.close()
+
+    # Всплеск входов через Telegram
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+    from app.main import app
+
+    user_updates = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("UPDATE users"):
+            user_updates.append(statement)
+
+    init_data = [build_init_data(1000 + i, settings.bot_token) for i in range(args.logins)]
+    client = TestClient(app)
+
+    print()
+    print(f"{'всплеск входов':<32}{'входов/с':>14}{'UPDATE users':>14}")
+    print("-" * 60)
+    for name in ("новые пользователи", "повторный вход"):
+        user_updates.clear()
+        rate = login_burst(client, init_data)
+        print(f"{name:<32}{rate:>14.0f}{len(user_updates):>14}")
+    print("=" * 60)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк запросов каталога GET /api/books
+
+Создает временную базу с синтетическими книгами, применяет миграции и для каждого
+варианта SortBy (без фильтра и с фильтрами) выводит время глубокой страницы
+в режиме offset и в курсорном режиме, а также проверяет по EXPLAIN QUERY PLAN,
+что запросы страницы не строят временное B-дерево для сортировки.
+
+Использование: python scripts/bench_catalog_queries.py [--books 50000] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Добавляем путь к приложению
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+def seed_books(db, books_count: int):
+    """Наполнение базы синтетическими категориями и книгами"""
+    from sqlalchemy import insert
+    from app.models import Book, Category
+
+    categories = [Category(name=f"Категория {i}", emoji="📚") for i in range(12)]
+    db.add_all(categories)
+    db.commit()
+
+    rnd = random.Random(42)
+    started = datetime(2023, 1, 1)
+    rows = []
+    for i in range(books_count):
+        rows.append({
+            "title": f"Книга {rnd.randint(0, 10 ** 6)}",
+            "author": f"Автор {rnd.randint(0, 5000)}",
+            "description": "Описание",
+            "duration_seconds": None if i % 25 == 0 else rnd.randint(600, 60000),
+            "category_id": categories[i % len(categories)].id,
+            "rating": round(rnd.uniform(0, 5), 1),
+            "plays_count": rnd.randint(0, 1000),
+            "is_free": rnd.random() < 0.5,
+            "is_active": rnd.random() < 0.95,
+            "created_at": started + timedelta(minutes=i),
+        })
+    db.execute(insert(Book), rows)
+    db.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк запросов каталога")
+    parser.add_argument("--books", type=int, default=50000, help="Количество книг")
+    parser.add_argument("--repeat", type=int, default=20, help="Повторов на замер")
+    args = parser.parse_args()
+
+    # База создается до импорта приложения, чтобы движок указывал на нее
+    temp_dir = tempfile.mkdtemp(prefix="audioflow-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(temp_dir, 'bench.db')}"
+
+    from sqlalchemy import event, text
+    from app.database import engine, SessionLocal
+    from app.models import Base
+    from app.migrations import run_migrations
+    from app.routers.books import BookFilters, SortBy, count_cache, fetch_catalog_page
+
+    print("🎧 Бенчмарк запросов каталога AudioFlow")
+    print("=" * 78)
+    print(f"База: {temp_dir}, книг: {args.books}")
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    seed_books(db, args.books)
+    run_migrations(engine)
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+
+    captured = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if "FROM books" in statement and not statement.startswith("EXPLAIN"):
+            captured.append((statement, parameters))
+
+    def timed(fn) -> float:
+        fn()
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            fn()
+        return (time.perf_counter() - started) / args.repeat * 1000
+
+    filter_sets = {
+        "без фильтров": BookFilters(None, None, None, None, None, None),
+        "категория": BookFilters(1, None, None, None, None, None),
+        "категория+free": BookFilters(1, True, None, None, None, None),
+    }
+    deep_offset = args.books // 2 // len(filter_sets)
+
+    failures = 0
+    print(f"{'сортировка':<16}{'фильтр':<16}{'offset, мс':>12}{'cursor, мс':>12}  план")
+    print("-" * 78)
+    for sort_by in SortBy:
+        for filter_name, filters in filter_sets.items():
+            # Курсор, указывающий в середину выдачи
+            _, _, deep_cursor = fetch_catalog_page(db, filters, sort_by, 20, offset=deep_offset)
+
+            def offset_page():
+                count_cache.clear()
+                fetch_catalog_page(db, filters, sort_by, 20, offset=deep_offset)
+
+            def cursor_page():
+                fetch_catalog_page(db, filters, sort_by, 20, cursor=deep_cursor)
+
+            offset_ms = timed(offset_page)
+            cursor_ms = timed(cursor_page)
+
+            # Планы всех запросов первой страницы и курсорной страницы
+            captured.clear()
+            count_cache.clear()
+            fetch_catalog_page(db, filters, sort_by, 20)
+            fetch_catalog_page(db, filters, sort_by, 20, cursor=deep_cursor)
+            temp_btree = False
+            with engine.connect() as conn:
+                for statement, parameters in list(captured):
+                    plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+                    if any("TEMP B-TREE" in row[-1] for row in plan):
+                        temp_btree = True
+                        print("   ⚠️  " + "; ".join(row[-1] for row in plan))
+
+            failures += temp_btree
+            status = "❌ TEMP B-TREE" if temp_btree else "✅ индекс"
+            print(f"{sort_by.value:<16}{filter_name:<16}{offset_ms:>12.2f}{cursor_ms:>12.2f}  {status}")
+
+    db.close()
+    print("=" * 78)
+    if failures:
+        print(f"❌ Временное B-дерево в {failures} вариантах")
+        sys.exit(1)
+    print("🎉 Все варианты сортировки используют индексы")
+
+if __name__ == "__main__":
+    main()
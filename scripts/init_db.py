@@ -10,6 +10,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from app.database import engine, SessionLocal
 from app.models import Base, Category, Admin
+from app.migrations import run_migrations
 from app.config import settings
 from passlib.context import CryptContext
 
@@ -19,6 +20,7 @@ def create_tables():
     """Создание всех таблиц в базе данных"""
     print("Создание таблиц базы данных...")
     Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
     print("✅ Таблицы созданы успешно")
 
 def create_default_categories():
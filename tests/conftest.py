@@ -0,0 +1,166 @@
+"""
+Общие фикстуры тестов: временная база SQLite, клиент API и счетчик SQL-запросов
+
+Запуск из корня репозитория: python -m pytest tests/ (нужны pytest и httpx)
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# База и каталог загрузок задаются до импорта приложения, чтобы движок указывал на них
+TEST_DIR = tempfile.mkdtemp(prefix="audioflow-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}"
+os.environ["UPLOAD_DIR"] = os.path.join(TEST_DIR, "uploads")
+# Поколение каталога и отозванные токены перечитываются только после прогрева,
+# поэтому число запросов в замерах не зависит от времени выполнения
+os.environ["CATALOG_VERSION_CHECK_INTERVAL"] = "3600"
+os.environ["REVOCATION_SYNC_INTERVAL"] = "3600"
+
+# Добавляем путь к приложению
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app.main import app
+from app.auth import create_access_token, create_admin_token, token_cache, user_cache
+from app.cache import active_book_cache, response_cache
+from app.idempotency import idempotency_store
+from app.database import Base, SessionLocal, engine
+from app.models import Admin, Book, CatalogState, Category, Favorite, ListeningHistory, User
+from app.progress_buffer import progress_buffer
+from app.routers.books import count_cache
+from app.serialization import book_json_cache
+
+def _reset_caches():
+    for cache in (
+        response_cache, count_cache, active_book_cache, book_json_cache, user_cache, token_cache, idempotency_store
+    ):
+        cache.clear()
+
+@pytest.fixture(autouse=True)
+def clean_database():
+    """Пустые таблицы и кэши перед каждым тестом"""
+    db = SessionLocal()
+    progress_buffer.flush(db)
+    db.close()
+    with engine.begin() as conn:
+        # Триггеры удаления дописывают надгробия и статистику, поэтому второй проход
+        for _ in range(2):
+            for table in reversed(Base.metadata.sorted_tables):
+                if table.name != CatalogState.__tablename__:
+                    conn.execute(table.delete())
+    _reset_caches()
+    yield
+
+@pytest.fixture
+def reset_caches():
+    """Сброс кэшей в памяти воркера: следующий запрос читает все из БД"""
+    return _reset_caches
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    yield session
+    session.close()
+
+@pytest.fixture
+def client():
+    # Без контекстного менеджера: фоновые задачи приложения в тестах не запускаются
+    return TestClient(app)
+
+@pytest.fixture
+def queries():
+    """Список SQL-операторов, выполненных движком за время теста"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(engine, "before_cursor_execute", record)
+
+@pytest.fixture
+def measure_queries(client, queries, reset_caches):
+    """SQL-операторы одного GET после прогрева и тело ответа.
+
+    Прогрев читает поколение каталога и отозванные токены; затем кэши
+    ответов, книг и пользователей сбрасываются, если не передан warm_caches"""
+    def measure(url: str, headers=None, warm_caches: bool = False):
+        client.get(url, headers=headers)
+        if not warm_caches:
+            reset_caches()
+        queries.clear()
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200, response.text
+        return list(queries), response.json()
+
+    return measure
+
+@pytest.fixture
+def user(db):
+    user = User(telegram_id=1, username="listener", first_name="Listener")
+    db.add(user)
+    db.commit()
+    return user
+
+@pytest.fixture
+def auth_headers(user):
+    return {"Authorization": f"Bearer {create_access_token({'sub': str(user.id)})}"}
+
+@pytest.fixture
+def admin_headers(db):
+    admin = Admin(username="admin", email="admin@example.com", password_hash="-", is_active=True)
+    db.add(admin)
+    db.commit()
+    return {"Authorization": f"Bearer {create_admin_token(admin.id)}"}
+
+@pytest.fixture
+def add_books(db):
+    """Создание n активных книг; возвращает их id.
+
+    У каждой книги своя категория, чтобы ленивая загрузка категорий по строке
+    была видна в числе запросов"""
+    def add(n: int):
+        start = db.query(Book).count()
+        categories = [Category(name=f"Категория {start + i}", emoji="📚") for i in range(n)]
+        db.add_all(categories)
+        db.flush()
+        books = [
+            Book(
+                title=f"Война и мир, том {start + i}",
+                author=f"Автор {(start + i) % 7}",
+                description="Описание книги",
+                duration_seconds=3600 + start + i,
+                category_id=category.id,
+                is_free=bool(i % 2),
+                is_active=True
+            )
+            for i, category in enumerate(categories)
+        ]
+        db.add_all(books)
+        db.commit()
+        return [book.id for book in books]
+
+    return add
+
+@pytest.fixture
+def add_to_library(db, user):
+    """История и избранное пользователя по каждой книге"""
+    def add(book_ids):
+        now = datetime.utcnow()
+        for i, book_id in enumerate(book_ids):
+            db.add(ListeningHistory(
+                user_id=user.id,
+                book_id=book_id,
+                current_position=60,
+                total_duration=3600,
+                last_played=now - timedelta(minutes=i)
+            ))
+            db.add(Favorite(user_id=user.id, book_id=book_id))
+        db.commit()
+
+    return add
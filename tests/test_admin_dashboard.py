@@ -0,0 +1,27 @@
+"""
+Дашборд админки: прослушивания из books.plays_count, время - из дневных сверток
+"""
+from sqlalchemy import func
+
+from app.analytics import run_rollup
+from app.models import Book
+from app.progress_buffer import progress_buffer
+
+def test_dashboard_reads_plays_and_listening_rollups(client, db, auth_headers, admin_headers, add_books):
+    book_ids = add_books(3)
+    # Прослушивания, накопленные до истории (например, при импорте каталога)
+    db.query(Book).filter(Book.id == book_ids[2]).update({Book.plays_count: 7})
+    db.commit()
+
+    for book_id in book_ids[:2]:
+        response = client.post(f"/api/user/history/{book_id}", json={"position": 120, "duration": 3600}, headers=auth_headers)
+        assert response.status_code == 200
+    progress_buffer.flush(db)
+    run_rollup(db)
+
+    stats = client.get("/api/admin/dashboard", headers=admin_headers).json()["stats"]
+    db.expire_all()
+    assert stats["total_plays"] == db.query(func.sum(Book.plays_count)).scalar()
+    assert stats["total_plays"] == 9
+    assert stats["listeners_today"] == 1
+    assert stats["listened_seconds_today"] > 0
@@ -0,0 +1,72 @@
+"""
+Одна пара (пользователь, книга) под одновременными запросами из нескольких процессов:
+избранное, отметка о прослушивании и оценка - одиночные upsert-ы без гонок
+"""
+import multiprocessing
+
+from app.auth import create_access_token
+from app.models import BookRatingStats, Favorite, ListeningHistory, Rating, UserLibraryStats
+
+PROCESSES = 6
+ROUNDS = 15
+
+def hammer(token: str, book_id: int, worker: int, start, results):
+    """Процесс-клиент: импортирует приложение (база - из DATABASE_URL родителя)
+    и, когда все процессы готовы, повторяет мутирующие запросы к одной книге"""
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    client = TestClient(app)
+    headers = {"Authorization": f"Bearer {token}"}
+    failures = []
+    start.wait()
+    for i in range(ROUNDS):
+        rating = (worker + i) % 5 + 1
+        for method, url, body in (
+            ("POST", f"/api/user/favorites/{book_id}", None),
+            ("POST", f"/api/user/history/{book_id}/finish", None),
+            ("POST", f"/api/user/ratings/{book_id}", {"rating": rating}),
+        ):
+            response = client.request(method, url, json=body, headers=headers)
+            if response.status_code != 200:
+                failures.append((url, response.status_code, response.text))
+    results.put(failures)
+
+def test_one_pair_under_concurrent_upserts(db, user, add_books):
+    (book_id,) = add_books(1)
+    token = create_access_token({"sub": str(user.id)})
+
+    # spawn: дочерние процессы не наследуют соединения движка родителя
+    context = multiprocessing.get_context("spawn")
+    start = context.Barrier(PROCESSES + 1)
+    results = context.Queue()
+    processes = [
+        context.Process(target=hammer, args=(token, book_id, worker, start, results))
+        for worker in range(PROCESSES)
+    ]
+    for process in processes:
+        process.start()
+    start.wait(timeout=120)
+    failures = [failure for _ in processes for failure in results.get(timeout=120)]
+    for process in processes:
+        process.join(timeout=30)
+
+    assert failures == []
+    assert all(process.exitcode == 0 for process in processes)
+
+    pair = {"user_id": user.id, "book_id": book_id}
+    assert db.query(Favorite).filter_by(**pair).count() == 1
+    assert db.query(ListeningHistory).filter_by(**pair).count() == 1
+    assert db.query(ListeningHistory).filter_by(**pair).one().is_finished
+    ratings = db.query(Rating).filter_by(**pair).all()
+    assert len(ratings) == 1
+
+    # Агрегаты триггеров совпадают с единственной оставшейся оценкой
+    stats = db.get(BookRatingStats, book_id)
+    value = ratings[0].rating
+    assert (stats.rating_count, stats.rating_sum) == (1, value)
+    assert stats.histogram == [int(score == value) for score in range(1, 6)]
+    assert ratings[0].book.rating == value
+
+    library_stats = db.get(UserLibraryStats, user.id)
+    assert (library_stats.total_books, library_stats.finished_books) == (1, 1)
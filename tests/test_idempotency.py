@@ -0,0 +1,64 @@
+"""
+Повторы мутирующих запросов с Idempotency-Key
+"""
+import asyncio
+
+import pytest
+
+from app.idempotency import IdempotencyMiddleware, idempotency_store
+
+def test_retry_replays_stored_response(client, queries, auth_headers, add_books):
+    (book_id,) = add_books(1)
+    headers = {**auth_headers, "Idempotency-Key": "favorite-1"}
+
+    first = client.post(f"/api/user/favorites/{book_id}", headers=headers)
+    assert first.status_code == 200
+    assert "idempotent-replayed" not in first.headers
+
+    queries.clear()
+    retry = client.post(f"/api/user/favorites/{book_id}", headers=headers)
+    assert retry.status_code == 200
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.content == first.content
+    assert queries == []
+
+def test_key_reused_with_other_body_is_rejected(client, auth_headers, add_books):
+    (book_id,) = add_books(1)
+    headers = {**auth_headers, "Idempotency-Key": "rating-1"}
+
+    assert client.post(f"/api/user/ratings/{book_id}", json={"rating": 3}, headers=headers).status_code == 200
+    response = client.post(f"/api/user/ratings/{book_id}", json={"rating": 4}, headers=headers)
+    assert response.status_code == 422
+
+def test_other_paths_are_not_replayed(client, admin_headers):
+    headers = {**admin_headers, "Idempotency-Key": "category-1"}
+    for name in ("Первая", "Вторая"):
+        response = client.post("/api/admin/categories", json={"name": name, "emoji": "📚"}, headers=headers)
+        assert response.status_code == 200
+        assert response.json()["name"] == name
+        assert "idempotent-replayed" not in response.headers
+    assert len(idempotency_store) == 0
+
+def test_cancelled_request_releases_key():
+    async def cancelled_app(scope, receive, send):
+        await receive()
+        raise asyncio.CancelledError
+
+    async def receive():
+        return {"type": "http.request", "body": b"{}", "more_body": False}
+
+    async def send(message):
+        pass
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/api/user/favorites/1",
+        "query_string": b"",
+        "headers": [(b"idempotency-key", b"favorite-1")],
+    }
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(IdempotencyMiddleware(cancelled_app)(scope, receive, send))
+
+    # Без снятой отметки повтор получал бы 409 до истечения TTL
+    assert len(idempotency_store) == 0
@@ -0,0 +1,38 @@
+"""
+Дельта-синхронизация библиотеки: скрытие книги в админке приходит клиенту
+как удаление, возврат в каталог - как повторное добавление
+"""
+import pytest
+
+@pytest.mark.parametrize("url, book_id", [
+    ("/api/user/library/history", lambda item: item["book"]["id"]),
+    ("/api/user/library/favorites", lambda item: item["id"]),
+])
+def test_visibility_change_reaches_delta_sync(url, book_id, client, auth_headers, admin_headers, add_books, add_to_library):
+    book_ids = add_books(3)
+    add_to_library(book_ids)
+    hidden = book_ids[1]
+
+    body = client.get(f"{url}?since=0", headers=auth_headers).json()
+    assert {book_id(item) for item in body["items"]} == set(book_ids)
+    version = body["library_version"]
+
+    response = client.post(f"/api/admin/books/{hidden}/toggle-status", headers=admin_headers)
+    assert response.json()["is_active"] is False
+    body = client.get(f"{url}?since={version}", headers=auth_headers).json()
+    assert body["items"] == []
+    assert body["removed"] == [hidden]
+    assert body["library_version"] > version
+    version = body["library_version"]
+
+    response = client.put(f"/api/admin/books/{hidden}", json={"is_active": True}, headers=admin_headers)
+    assert response.status_code == 200
+    body = client.get(f"{url}?since={version}", headers=auth_headers).json()
+    assert [book_id(item) for item in body["items"]] == [hidden]
+    assert body["removed"] == []
+
+    # Изменение других полей книги версии библиотеки не трогает
+    version = body["library_version"]
+    client.put(f"/api/admin/books/{hidden}", json={"title": "Новое название"}, headers=admin_headers)
+    body = client.get(f"{url}?since={version}", headers=auth_headers).json()
+    assert (body["items"], body["removed"], body["library_version"]) == ([], [], version)
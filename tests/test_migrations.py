@@ -0,0 +1,133 @@
+"""
+Миграции на базе, обновленной предыдущими версиями схемы
+"""
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
+
+from app.database import Base
+from app.migrations import run_migrations
+from app.models import Book, Favorite, Rating, User
+
+def legacy_rating_stats_sql(alias: str, sign: str) -> str:
+    """Тело триггеров агрегатов оценок в первой версии (INSERT OR IGNORE)"""
+    histogram = ", ".join(
+        f"count_{value} = count_{value} {sign} ({alias}.rating = {value})" for value in range(1, 6)
+    )
+    return f"""
+        INSERT OR IGNORE INTO book_rating_stats
+            (book_id, rating_sum, rating_count, count_1, count_2, count_3, count_4, count_5)
+        VALUES ({alias}.book_id, 0, 0, 0, 0, 0, 0, 0);
+        UPDATE book_rating_stats
+        SET rating_sum = rating_sum {sign} {alias}.rating,
+            rating_count = rating_count {sign} 1,
+            {histogram}
+        WHERE book_id = {alias}.book_id;
+    """
+
+def install_legacy_rating_triggers(engine):
+    with engine.begin() as conn:
+        for name in ("ratings_stats_insert", "ratings_stats_delete", "ratings_stats_update"):
+            conn.execute(text(f"DROP TRIGGER {name}"))
+        conn.execute(text(f"""
+            CREATE TRIGGER ratings_stats_insert AFTER INSERT ON ratings BEGIN
+                {legacy_rating_stats_sql("new", "+")}
+            END
+        """))
+        conn.execute(text(f"""
+            CREATE TRIGGER ratings_stats_delete AFTER DELETE ON ratings BEGIN
+                {legacy_rating_stats_sql("old", "-")}
+            END
+        """))
+        conn.execute(text(f"""
+            CREATE TRIGGER ratings_stats_update AFTER UPDATE OF rating, book_id ON ratings BEGIN
+                {legacy_rating_stats_sql("old", "-")}
+                {legacy_rating_stats_sql("new", "+")}
+            END
+        """))
+
+def rate(conn, user_id: int, book_id: int, value: int):
+    """Оценка тем же upsert-ом, что и в POST /api/user/ratings"""
+    stmt = insert(Rating).values(user_id=user_id, book_id=book_id, rating=value)
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[Rating.user_id, Rating.book_id],
+        set_={"rating": stmt.excluded.rating}
+    ))
+
+@pytest.fixture
+def legacy_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    install_legacy_rating_triggers(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{"telegram_id": 1}, {"telegram_id": 2}])
+        conn.execute(insert(Book).values(id=1, title="Книга", author="Автор"))
+        rate(conn, 1, 1, 4)
+    yield engine
+    engine.dispose()
+
+def test_legacy_rating_triggers_break_rerating(legacy_engine):
+    # Upsert, ставший UPDATE-ом, передает политику конфликтов триггеру: OR IGNORE не действует
+    with pytest.raises(IntegrityError):
+        with legacy_engine.begin() as conn:
+            rate(conn, 1, 1, 2)
+
+def test_migration_recreates_legacy_rating_triggers(legacy_engine):
+    run_migrations(legacy_engine)
+
+    with legacy_engine.begin() as conn:
+        triggers = conn.execute(text(
+            "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'ratings_stats_%'"
+        )).scalars().all()
+        assert len(triggers) == 3
+        assert not [sql for sql in triggers if "INSERT OR IGNORE" in sql]
+
+        rate(conn, 1, 1, 3)
+        rate(conn, 2, 1, 2)
+        rate(conn, 2, 1, 5)
+
+    with legacy_engine.connect() as conn:
+        # Агрегаты, накопленные старыми триггерами, не пересчитываются и остаются верными
+        stats = conn.execute(text(
+            "SELECT rating_sum, rating_count, count_2, count_3, count_4, count_5 FROM book_rating_stats WHERE book_id = 1"
+        )).one()
+        assert tuple(stats) == (8, 2, 0, 1, 0, 1)
+        assert conn.execute(text("SELECT rating FROM books WHERE id = 1")).scalar() == 4.0
+
+def test_migration_drops_legacy_favorite_counter(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'favorites.db'}")
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    # Схема первой версии: счетчик избранного в статистике и его триггеры
+    with engine.begin() as conn:
+        conn.execute(text(
+            "ALTER TABLE user_library_stats ADD COLUMN favorite_count INTEGER DEFAULT 0 NOT NULL"
+        ))
+        conn.execute(text("""
+            CREATE TRIGGER favorites_stats_insert AFTER INSERT ON favorites BEGIN
+                UPDATE user_library_stats SET favorite_count = favorite_count + 1 WHERE user_id = new.user_id;
+            END
+        """))
+        conn.execute(text("""
+            CREATE TRIGGER favorites_stats_delete AFTER DELETE ON favorites BEGIN
+                UPDATE user_library_stats SET favorite_count = favorite_count - 1 WHERE user_id = old.user_id;
+            END
+        """))
+
+    run_migrations(engine)
+    run_migrations(engine)
+
+    with engine.begin() as conn:
+        assert conn.execute(text(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'favorites_stats_%'"
+        )).scalar() == 0
+        columns = {row[1] for row in conn.execute(text("PRAGMA table_info(user_library_stats)"))}
+        assert "favorite_count" not in columns
+
+        conn.execute(insert(User).values(id=1, telegram_id=1))
+        conn.execute(insert(Book).values(id=1, title="Книга", author="Автор"))
+        conn.execute(insert(Favorite).values(user_id=1, book_id=1))
+        conn.execute(Favorite.__table__.delete())
+    engine.dispose()
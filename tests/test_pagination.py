@@ -0,0 +1,68 @@
+"""
+Курсорная пагинация каталога и библиотеки: обход страниц выдает каждую строку один раз
+"""
+import pytest
+
+from app.models import Book
+from app.pagination import encode_cursor
+
+def walk(client, url, key, headers=None):
+    """Все элементы при обходе страниц по next_cursor"""
+    items, cursor = [], None
+    while True:
+        page_url = url + (f"&cursor={cursor}" if cursor else "")
+        response = client.get(page_url, headers=headers)
+        assert response.status_code == 200, response.text
+        body = response.json()
+        items += body[key]
+        cursor = body["next_cursor"]
+        if not cursor:
+            return items
+
+@pytest.mark.parametrize("sort_by", ["duration_short", "duration_long", "newest", "alphabetical"])
+def test_catalog_cursor_walk_matches_offset_order(sort_by, client, db, add_books):
+    book_ids = add_books(23)
+    # Книги без длительности - отдельный сегмент порядка (NULL в SQLite)
+    db.query(Book).filter(Book.id.in_(book_ids[::4])).update({Book.duration_seconds: None}, synchronize_session=False)
+    db.commit()
+
+    expected = client.get(f"/api/books?sort_by={sort_by}&limit=100").json()["books"]
+    walked = walk(client, f"/api/books?sort_by={sort_by}&limit=5", "books")
+
+    assert [book["id"] for book in walked] == [book["id"] for book in expected]
+    assert len(walked) == 23
+
+def test_catalog_cursor_rejects_other_sort_order(client, add_books):
+    add_books(3)
+    cursor = encode_cursor(3600, 1, "newest")
+    assert client.get(f"/api/books?sort_by=popular&cursor={cursor}").status_code == 400
+    assert client.get("/api/books?cursor=not-a-cursor").status_code == 400
+
+def test_library_history_cursor_walk(client, auth_headers, add_books, add_to_library):
+    add_to_library(add_books(12))
+
+    walked = walk(client, "/api/user/library/history?limit=5", "items", auth_headers)
+    favorites = walk(client, "/api/user/library/favorites?limit=5", "items", auth_headers)
+
+    assert len({item["book"]["id"] for item in walked}) == 12
+    played = [item["last_played"] for item in walked]
+    assert played == sorted(played, reverse=True)
+    assert len({book["id"] for book in favorites}) == 12
+
+@pytest.mark.parametrize("url", [
+    "/api/books",
+    "/api/books/search?q=война",
+    "/api/admin/books",
+    "/api/admin/users",
+])
+@pytest.mark.parametrize("limit", [0, -1])
+def test_non_positive_limit_is_rejected(url, limit, client, admin_headers, add_books):
+    add_books(3)
+    separator = "&" if "?" in url else "?"
+    response = client.get(f"{url}{separator}limit={limit}", headers=admin_headers)
+    assert response.status_code == 422
+
+def test_single_item_pages(client, add_books):
+    add_books(3)
+    walked = walk(client, "/api/books?sort_by=oldest&limit=1", "books")
+    assert len(walked) == 3
@@ -0,0 +1,37 @@
+"""
+Буфер прогресса: каталог показывает незаписанный прогресс, не записывая его в БД
+"""
+def test_catalog_overlays_buffered_progress(client, measure_queries, auth_headers, add_books):
+    book_ids = add_books(50)
+    url = "/api/books?limit=50&sort_by=oldest"
+    baseline, _ = measure_queries(url, auth_headers)
+
+    response = client.post(
+        f"/api/user/history/{book_ids[0]}",
+        json={"position": 3500, "duration": 3600},
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+    statements, body = measure_queries(url, auth_headers)
+
+    # Без коммита в GET книги страницы не перечитываются по одной
+    assert len(statements) == len(baseline)
+    assert not [statement for statement in statements if not statement.lstrip().startswith("SELECT")]
+
+    progress = body["books"][0]["user_progress"]
+    assert body["books"][0]["id"] == book_ids[0]
+    assert progress["current_position"] == 3500
+    assert progress["is_finished"] is True
+    assert body["books"][1]["user_progress"]["current_position"] == 0
+
+def test_search_overlays_buffered_progress(client, measure_queries, auth_headers, add_books):
+    book_ids = add_books(20)
+    url = "/api/books/search?q=война"
+    baseline, _ = measure_queries(url, auth_headers)
+
+    for book_id in book_ids:
+        client.post(f"/api/user/history/{book_id}", json={"position": 60, "duration": 3600}, headers=auth_headers)
+    statements, body = measure_queries(url, auth_headers)
+
+    assert len(statements) == len(baseline)
+    assert {book["user_progress"]["current_position"] for book in body["books"]} == {60}
@@ -0,0 +1,23 @@
+"""
+Число SQL-запросов на страницу не зависит от количества книг на ней
+(категории и книги подгружаются joinedload, а не отдельным запросом на строку)
+"""
+import pytest
+
+@pytest.mark.parametrize("url, items", [
+    ("/api/books?limit=100", lambda body: body["books"]),
+    ("/api/books/search?q=война&limit=100", lambda body: body["books"]),
+    ("/api/user/library", lambda body: body["history"] + body["favorites"]),
+    ("/api/admin/books?limit=100", lambda body: body),
+])
+def test_query_count_is_constant_per_page(url, items, measure_queries, auth_headers, admin_headers, add_books, add_to_library):
+    headers = admin_headers if url.startswith("/api/admin") else auth_headers
+
+    add_to_library(add_books(10))
+    small_statements, small_body = measure_queries(url, headers)
+
+    add_to_library(add_books(90))
+    large_statements, large_body = measure_queries(url, headers)
+
+    assert len(items(large_body)) == 10 * len(items(small_body))
+    assert len(large_statements) == len(small_statements)
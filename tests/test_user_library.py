@@ -0,0 +1,30 @@
+"""
+Библиотека пользователя: число запросов не растет с размером истории
+"""
+from app.auth import user_cache
+from app.models import Book
+
+def test_library_query_count_with_500_history_rows(measure_queries, auth_headers, add_books, add_to_library):
+    add_to_library(add_books(500))
+
+    # Поиск пользователя (снимок в кэше сброшен) + история, избранное и статистика
+    statements, body = measure_queries("/api/user/library", auth_headers)
+    assert len(body["history"]) == 500
+    assert body["stats"]["total_books"] == 500
+    assert len(statements) == 4
+    assert sum("FROM users " in statement for statement in statements) == 1
+
+    # Со снимком пользователя в кэше остаются три запроса
+    statements, _ = measure_queries("/api/user/library", auth_headers, warm_caches=True)
+    assert len(statements) == 3
+    assert len(user_cache) == 1
+
+def test_library_favorite_count_matches_visible_favorites(client, db, auth_headers, add_books, add_to_library):
+    book_ids = add_books(3)
+    add_to_library(book_ids)
+    db.query(Book).filter(Book.id == book_ids[0]).update({Book.is_active: False})
+    db.commit()
+
+    body = client.get("/api/user/library", headers=auth_headers).json()
+    assert len(body["favorites"]) == 2
+    assert body["stats"]["favorite_count"] == 2